@@ -1,12 +1,27 @@
-import random
+from datetime import date, timedelta
+
+import pandas as pd
 import streamlit as st
 
 from services.quiz_service import (
     get_subjects,
     get_topics_by_subject,
-    get_questions_by_topic,
+    get_questions_cached,
+    prefetch_questions,
     get_subject_name,
     get_topic_name,
+    get_daily_stats,
+    get_flagged_questions,
+    get_percentile,
+    save_quiz_result,
+    new_quiz_seed,
+    shuffle_options,
+)
+from services.checkpoint_service import (
+    new_attempt_id,
+    save_checkpoint,
+    discard_checkpoint,
+    get_latest_checkpoint,
 )
 
 # ---------------------- ACCESO POR CORREOS PERMITIDOS ---------------------- #
@@ -50,8 +65,13 @@ def init_state():
     if "selected_topic_id" not in st.session_state:
         st.session_state.selected_topic_id = None
 
-    if "questions" not in st.session_state:
-        st.session_state.questions = []
+    if "quiz_seed" not in st.session_state:
+        # semilla del intento: con ella y el tema se reconstruye el cuestionario
+        st.session_state.quiz_seed = None
+
+    if "attempt_id" not in st.session_state:
+        # id del intento en curso (para guardarlo y poder retomarlo)
+        st.session_state.attempt_id = None
 
     if "user_answers" not in st.session_state:
         # dict: question_id -> option_id
@@ -89,6 +109,7 @@ def login_screen():
         if email_clean in ALLOWED_EMAILS:
             st.session_state.logged_in = True
             st.session_state.user_email = email_clean
+            resume_last_attempt()
             st.success("Acceso permitido. ¡Bienvenido!")
             st.rerun()
         else:
@@ -100,23 +121,88 @@ def login_screen():
 
 def start_quiz_for_topic(topic_id: int):
     """
-    Carga las preguntas de un tema, baraja las opciones y prepara el estado
-    de sesión para empezar el cuestionario.
+    Prepara el estado de sesión para empezar el cuestionario de un tema.
+
+    No se guardan las preguntas en sesión: solo el tema y una semilla nueva.
+    El orden de las opciones se recalcula con `get_quiz_questions`.
     """
-    questions = get_questions_by_topic(topic_id)
+    questions = get_questions_cached(topic_id)
 
-    # Barajar opciones de cada pregunta
-    for q in questions:
-        random.shuffle(q["options"])
+    abandon_attempt()
 
     st.session_state.selected_topic_id = topic_id
-    st.session_state.questions = questions
+    st.session_state.quiz_seed = new_quiz_seed()
+    st.session_state.attempt_id = new_attempt_id()
     st.session_state.user_answers = {}
     st.session_state.score = 0
     st.session_state.total_questions = len(questions)
     st.session_state.review = []
     st.session_state.step = "quiz"
 
+    checkpoint_attempt()
+
+
+def checkpoint_attempt():
+    """
+    Apunta el estado del intento en curso. La escritura real se hace por
+    lotes en segundo plano (ver services/checkpoint_service.py).
+    """
+    if st.session_state.attempt_id is None:
+        return
+
+    save_checkpoint(
+        st.session_state.user_email,
+        st.session_state.attempt_id,
+        st.session_state.selected_subject_id,
+        st.session_state.selected_topic_id,
+        st.session_state.quiz_seed,
+        st.session_state.user_answers,
+    )
+
+
+def abandon_attempt():
+    """
+    Olvida el intento en curso (terminado o abandonado).
+    """
+    if st.session_state.attempt_id is not None:
+        discard_checkpoint(st.session_state.user_email, st.session_state.attempt_id)
+        st.session_state.attempt_id = None
+
+
+def resume_last_attempt():
+    """
+    Si el usuario tenía un cuestionario a medias (por ejemplo, antes de un
+    reinicio del servidor), lo recupera tal y como estaba.
+    """
+    checkpoint = get_latest_checkpoint(st.session_state.user_email)
+    if checkpoint is None:
+        return
+
+    st.session_state.selected_subject_id = checkpoint["subject_id"]
+    st.session_state.selected_topic_id = checkpoint["topic_id"]
+    st.session_state.quiz_seed = checkpoint["quiz_seed"]
+    st.session_state.attempt_id = checkpoint["attempt_id"]
+    st.session_state.user_answers = checkpoint["answers"]
+    st.session_state.score = 0
+    st.session_state.total_questions = 0
+    st.session_state.review = []
+    st.session_state.step = "quiz"
+    st.session_state.resumed_attempt = True
+
+
+def get_quiz_questions():
+    """
+    Reconstruye las preguntas del intento actual (tema + semilla) con las
+    opciones ya barajadas y etiquetadas.
+    """
+    topic_id = st.session_state.selected_topic_id
+    seed = st.session_state.quiz_seed
+
+    if topic_id is None or seed is None:
+        return []
+
+    return shuffle_options(get_questions_cached(topic_id), seed)
+
 
 def build_topic_label(subject_id: int, topic_id: int) -> str:
     """
@@ -178,7 +264,7 @@ def select_subject_step():
         # Guardamos asignatura y reseteamos todo lo relacionado con el quiz
         st.session_state.selected_subject_id = selected_subject_id
         st.session_state.selected_topic_id = None
-        st.session_state.questions = []
+        st.session_state.quiz_seed = None
         st.session_state.user_answers = {}
         st.session_state.score = 0
         st.session_state.total_questions = 0
@@ -237,28 +323,135 @@ def select_topic_step():
     )
     selected_topic_id = id_by_label[selected_label]
 
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         if st.button("⬅️ Cambiar asignatura"):
             st.session_state.step = "select_subject"
             st.rerun()
 
     with col2:
+        if st.button("📈 Estadísticas"):
+            st.session_state.step = "stats"
+            st.rerun()
+
+    with col3:
         if st.button("Empezar cuestionario ✅"):
             start_quiz_for_topic(selected_topic_id)
             st.rerun()
 
 
+# ---------------------- PANTALLA DE ESTADÍSTICAS ---------------------- #
+
+
+def stats_step():
+    st.header("📈 Estadísticas")
+
+    subject_id = st.session_state.selected_subject_id
+    if subject_id is None:
+        st.session_state.step = "select_subject"
+        st.rerun()
+        return
+
+    subject_name = get_subject_name(subject_id) or "Asignatura"
+    st.subheader(f"Asignatura: **{subject_name}**")
+
+    topics = get_topics_by_subject(subject_id)
+    topic_labels = ["Todos los temas"] + [
+        f"Tema {t['number']}: {t['name']}" for t in topics
+    ]
+    topic_id_by_label = {
+        f"Tema {t['number']}: {t['name']}": t["id"] for t in topics
+    }
+
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_label = st.selectbox("Tema:", topic_labels)
+    with col2:
+        days = st.selectbox(
+            "Periodo:",
+            [7, 30, 90, 365],
+            index=1,
+            format_func=lambda d: f"Últimos {d} días",
+        )
+
+    stats = get_daily_stats(subject_id, topic_id_by_label.get(selected_label), days)
+
+    if not stats:
+        st.info("Todavía no hay resultados en este periodo.")
+    else:
+        attempts = sum(r["attempts"] for r in stats)
+        st.write(f"Intentos en el periodo: **{attempts}**")
+
+        # Eje X por fecha, con todos los días del periodo: los días sin
+        # intentos quedan como hueco en la línea
+        chart = pd.DataFrame(
+            {
+                "Nota media (%)": [round(r["avg_pct"], 1) for r in stats],
+                "Aprobados (%)": [round(r["pass_pct"], 1) for r in stats],
+            },
+            index=pd.to_datetime([r["day"] for r in stats]),
+        )
+        today = date.today()
+        chart = chart.reindex(
+            pd.date_range(today - timedelta(days=days), today, freq="D")
+        )
+        st.line_chart(chart)
+
+        st.dataframe(
+            [
+                {
+                    "Día": r["day"],
+                    "Intentos": r["attempts"],
+                    "Nota media (%)": round(r["avg_pct"], 1),
+                    "Aprobados (%)": round(r["pass_pct"], 1),
+                }
+                for r in stats
+            ],
+            hide_index=True,
+        )
+
+    flagged = get_flagged_questions(subject_id)
+    if flagged:
+        st.markdown("---")
+        st.subheader("🔎 Preguntas a revisar")
+
+        topic_number_by_id = {t["id"]: t["number"] for t in topics}
+        question_text = {}
+        for topic_id in {f["topic_id"] for f in flagged}:
+            for q in get_questions_cached(topic_id):
+                question_text[q["id"]] = q["text"]
+
+        st.dataframe(
+            [
+                {
+                    "Tema": topic_number_by_id.get(f["topic_id"]),
+                    "Pregunta": question_text.get(f["question_id"], f["question_id"]),
+                    "Intentos": f["attempts"],
+                    "Aciertos (%)": round(100 * (f["difficulty"] or 0), 1),
+                    "Discriminación": round(f["discrimination"] or 0, 2),
+                    "Motivo": ", ".join(f["reasons"]),
+                }
+                for f in flagged
+            ],
+            hide_index=True,
+        )
+
+    if st.button("⬅️ Volver a temas"):
+        st.session_state.step = "select_topic"
+        st.rerun()
+
+
 # ---------------------- PANTALLA 3: CUESTIONARIO (TODAS LAS PREGUNTAS) ---------------------- #
 
 
 def quiz_step():
     st.header("📖 Cuestionario")
 
-    questions = st.session_state.questions
+    questions = get_quiz_questions()
     if not questions:
         st.error("No hay preguntas cargadas para este tema.")
         if st.button("⬅️ Volver a temas"):
+            abandon_attempt()
             st.session_state.step = "select_topic"
             st.rerun()
         return
@@ -269,8 +462,15 @@ def quiz_step():
     topic_label = build_topic_label(subject_id, topic_id)
 
     st.caption(f"**{subject_name}** · {topic_label}")
+    st.caption(f"Intento #{st.session_state.quiz_seed}")
     st.write(f"Total de preguntas: **{len(questions)}**")
 
+    if st.session_state.pop("resumed_attempt", False):
+        st.info(
+            "Hemos recuperado tu cuestionario sin terminar. "
+            "Puedes seguir donde lo dejaste."
+        )
+
     # Mostramos TODAS las preguntas a la vez
     for idx, question in enumerate(questions, start=1):
         st.markdown(f"### {idx}. {question['text']}")
@@ -302,14 +502,17 @@ def quiz_step():
 
         st.markdown("---")
 
+    checkpoint_attempt()
+
     # Botones debajo de todo
     col1, col2 = st.columns([1, 1])
 
     with col1:
         if st.button("⬅️ Volver a elegir tema"):
             # Volver a pantalla de temas y limpiar solo cosas del cuestionario
+            abandon_attempt()
             st.session_state.step = "select_topic"
-            st.session_state.questions = []
+            st.session_state.quiz_seed = None
             st.session_state.user_answers = {}
             st.session_state.score = 0
             st.session_state.total_questions = 0
@@ -327,11 +530,12 @@ def quiz_step():
 
 
 def finish_quiz():
-    questions = st.session_state.questions
+    questions = get_quiz_questions()
     answers = st.session_state.user_answers
 
     correct_count = 0
     review = []
+    answered = []
 
     for q in questions:
         q_id = q["id"]
@@ -357,6 +561,8 @@ def finish_quiz():
         if is_correct:
             correct_count += 1
 
+        answered.append((q_id, selected_option_id, is_correct))
+
         review.append(
             {
                 "question_text": q["text"],
@@ -377,6 +583,18 @@ def finish_quiz():
     st.session_state.total_questions = total
     st.session_state.review = review
 
+    abandon_attempt()
+
+    if total:
+        save_quiz_result(
+            st.session_state.selected_subject_id,
+            st.session_state.selected_topic_id,
+            correct_count,
+            total,
+            answers=answered,
+            user_email=st.session_state.user_email,
+        )
+
 
 def results_step():
     st.header("📊 Resultado del cuestionario")
@@ -391,6 +609,7 @@ def results_step():
     subject_name = get_subject_name(subject_id) or "Asignatura"
     topic_label = build_topic_label(subject_id, topic_id)
     st.caption(f"**{subject_name}** · {topic_label}")
+    st.caption(f"Intento #{st.session_state.quiz_seed}")
 
     if total == 0 or not review:
         st.warning("No hay resultados para mostrar.")
@@ -402,6 +621,12 @@ def results_step():
     pct = (score / total) * 100
     st.write(f"Has acertado **{score} de {total}** preguntas. (**{pct:.1f}%**)")
 
+    percentile = get_percentile(topic_id, score, total)
+    if percentile is not None:
+        st.write(
+            f"Tu nota supera al **{percentile:.0f}%** de los intentos de este tema."
+        )
+
     if pct == 100:
         st.success("¡Perfecto! 🎉")
     elif pct >= 70:
@@ -461,6 +686,11 @@ def results_step():
         if idx < len(topic_ids_ordered) - 1:
             next_topic_id = topic_ids_ordered[idx + 1]
 
+    # Mientras el alumno lee sus resultados, cargamos en segundo plano los
+    # temas a los que puede saltar con los botones de abajo
+    prefetch_questions(next_topic_id)
+    prefetch_questions(prev_topic_id)
+
     nav_prev_col, nav_next_col = st.columns(2)
 
     with nav_prev_col:
@@ -489,7 +719,7 @@ def results_step():
     with top_col2:
         if st.button("🔙 Volver a elegir tema", key="btn_back_to_topics"):
             st.session_state.step = "select_topic"
-            st.session_state.questions = []
+            st.session_state.quiz_seed = None
             st.session_state.user_answers = {}
             st.session_state.score = 0
             st.session_state.total_questions = 0
@@ -526,6 +756,8 @@ def main():
         quiz_step()
     elif step == "results":
         results_step()
+    elif step == "stats":
+        stats_step()
     else:
         # Por si el estado se corrompe
         st.session_state.step = "select_subject"
@@ -0,0 +1,375 @@
+import argparse
+import csv
+
+import numpy as np
+
+from .catalog import get_catalog
+from .create_db import get_connection, get_results_connection, questions_schema
+from .import_from_csv import iter_csv_rows
+from .rollups import add_result_to_rollups
+
+# Respuestas que se leen y se pasan a arrays de cada vez
+GRADE_CHUNK_ROWS = 200_000
+
+LETTER_INDEX = {"A": 0, "B": 1, "C": 2, "D": 3}
+
+# Para combinar (tema, nº de pregunta) en un único entero
+_QUESTION_NUMBER_SPAN = 1_000_000
+
+
+# ---------------------- CLAVE DE RESPUESTAS ---------------------- #
+
+
+def load_answer_key():
+    """
+    Carga una sola vez la clave de todas las preguntas (también las de los
+    shards) como arrays de NumPy ordenados por id de pregunta:
+    question_id, topic_id, número de pregunta, subject_id y posición de la
+    opción correcta (0 = A ... , -1 si no tiene).
+
+    Las letras siguen el orden canónico de las opciones (por id), el mismo
+    que el de las columnas option_a..option_d del CSV de importación.
+    """
+    conn = get_connection()
+    subject_ids = [r[0] for r in conn.execute("SELECT id FROM subject")]
+
+    questions = []
+    options = []
+
+    for subject_id in subject_ids:
+        schema = questions_schema(conn, subject_id, mode="rw")
+        questions += conn.execute(
+            f"""
+            SELECT q.id, q.topic_id, q.number, t.subject_id
+            FROM {schema}.question q
+            JOIN topic t ON t.id = q.topic_id
+            WHERE t.subject_id = ?
+            """,
+            (subject_id,),
+        ).fetchall()
+        options += conn.execute(
+            f"""
+            SELECT o.question_id, o.is_correct
+            FROM {schema}.option o
+            JOIN {schema}.question q ON q.id = o.question_id
+            JOIN topic t ON t.id = q.topic_id
+            WHERE t.subject_id = ?
+            ORDER BY o.question_id, o.id
+            """,
+            (subject_id,),
+        ).fetchall()
+
+    conn.close()
+
+    q = np.array([tuple(r) for r in questions], dtype=np.int64).reshape(-1, 4)
+    order = np.argsort(q[:, 0])
+    q = q[order]
+
+    o = np.array([tuple(r) for r in options], dtype=np.int64).reshape(-1, 2)
+    o = o[np.lexsort((np.arange(len(o)), o[:, 0]))]
+
+    # Posición de cada opción dentro de su pregunta (0, 1, 2, 3)
+    group_start = np.r_[0, np.flatnonzero(np.diff(o[:, 0])) + 1] if len(o) else np.empty(0, int)
+    group_sizes = np.diff(np.r_[group_start, len(o)])
+    position = np.arange(len(o)) - np.repeat(group_start, group_sizes)
+
+    correct = np.full(len(q), -1, dtype=np.int64)
+    is_key = o[:, 1] == 1
+    key_question_pos = np.searchsorted(q[:, 0], o[is_key, 0])
+    # Si hubiera varias correctas, vale la primera
+    correct[key_question_pos[::-1]] = position[is_key][::-1]
+
+    return {
+        "question_id": q[:, 0],
+        "topic_id": q[:, 1],
+        "number": q[:, 2],
+        "subject_id": q[:, 3],
+        "correct": correct,
+    }
+
+
+def _topic_question_lookup(key, subject_id: int):
+    """
+    Índice (nº de tema, nº de pregunta) -> posición en la clave, para las
+    hojas que identifican la pregunta así en vez de por id.
+    """
+    catalog = get_catalog()
+    topic_number = {t["id"]: t["number"] for t in catalog.topics_by_subject(subject_id)}
+
+    in_subject = np.flatnonzero(key["subject_id"] == subject_id)
+    numbers = np.array(
+        [topic_number[t] for t in key["topic_id"][in_subject]], dtype=np.int64
+    )
+    codes = numbers * _QUESTION_NUMBER_SPAN + key["number"][in_subject]
+
+    order = np.argsort(codes)
+    return codes[order], in_subject[order]
+
+
+# ---------------------- CORRECCIÓN ---------------------- #
+
+
+def _find_sorted(sorted_values, values):
+    """
+    Busca `values` en el array ordenado `sorted_values`. Devuelve una
+    máscara de encontrados y sus posiciones (sin sentido donde no se
+    encontró).
+    """
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool), np.zeros(len(values), dtype=np.int64)
+
+    pos = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[pos] == values, pos
+
+
+def _keep_last_answer(codes, letters):
+    """
+    Deja una sola respuesta por código (alumno, pregunta): la última que
+    aparece. Devuelve (codes, letters, nº de duplicadas descartadas).
+    """
+    # np.unique se queda con la primera aparición: se busca al revés
+    unique_codes, first_from_end = np.unique(codes[::-1], return_index=True)
+    kept_letters = letters[::-1][first_from_end]
+    return unique_codes, kept_letters, len(codes) - len(unique_codes)
+
+
+def _grade_answers(key, students, question_pos, letters):
+    """
+    Corrige las respuestas (ya sin duplicados) de forma vectorizada y
+    devuelve {(alumno, topic_id): aciertos}.
+    """
+    students = np.asarray(students, dtype=np.int64)
+    question_pos = np.asarray(question_pos, dtype=np.int64)
+    letters = np.asarray(letters, dtype=np.int64)
+
+    correct = key["correct"][question_pos] == letters
+    topics = key["topic_id"][question_pos]
+
+    # Agrupar por (alumno, tema)
+    pairs = np.stack([students, topics], axis=1)
+    unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    hits = np.bincount(inverse.ravel(), weights=correct, minlength=len(unique_pairs))
+
+    return {
+        (student, topic_id): int(n_hits)
+        for (student, topic_id), n_hits in zip(unique_pairs.tolist(), hits.tolist())
+    }
+
+
+def grade_answer_sheets(csv_path: str, subject_id=None):
+    """
+    Corrige un CSV de hojas de respuestas. Columnas (con cabecera):
+
+      - student
+      - question_id, o bien topic_number + question_number (con `subject_id`)
+      - answer: letra elegida (A-D); vacía = sin responder
+
+    Si un alumno responde varias veces a la misma pregunta, vale la última
+    respuesta (las demás se cuentan como duplicate_answer en el informe).
+
+    Devuelve (scores, report): scores es una lista de dicts por alumno y
+    tema con aciertos y total de preguntas del tema.
+    """
+    key = load_answer_key()
+
+    rows = iter_csv_rows(csv_path)
+    header_row = next(rows, None)
+    if header_row is None:
+        return [], {"rows": 0, "graded": 0, "errors": {}}
+
+    header = [col.strip().lower() for col in header_row[1]]
+    col = {name: i for i, name in enumerate(header)}
+
+    missing = [name for name in ("student", "answer") if name not in col]
+    by_id = "question_id" in col
+    if not by_id:
+        missing += [
+            name for name in ("topic_number", "question_number") if name not in col
+        ]
+    if missing:
+        raise ValueError(
+            f"Faltan columnas en la cabecera: {', '.join(missing)} "
+            "(se espera student;question_id;answer o "
+            "student;topic_number;question_number;answer)."
+        )
+
+    if not by_id:
+        if subject_id is None:
+            raise ValueError(
+                "Sin columna question_id hay que indicar la asignatura (--subject)."
+            )
+        lookup_codes, lookup_pos = _topic_question_lookup(key, subject_id)
+
+    n_key = max(len(key["question_id"]), 1)
+    student_index = {}
+    student_names = []
+    # Respuestas leídas: código alumno * n_key + posición en la clave, y letra
+    code_chunks, letter_chunks = [], []
+    report = {"rows": 0, "graded": 0, "errors": {}}
+
+    batch_students, batch_questions, batch_letters = [], [], []
+
+    def flush():
+        if not batch_students:
+            return
+
+        values = np.array(batch_questions, dtype=np.int64)
+        if by_id:
+            found, pos = _find_sorted(key["question_id"], values)
+        else:
+            found, idx = _find_sorted(lookup_codes, values)
+            pos = lookup_pos[idx] if len(lookup_pos) else idx
+
+        unknown = int((~found).sum())
+        if unknown:
+            report["errors"]["unknown_question"] = (
+                report["errors"].get("unknown_question", 0) + unknown
+            )
+
+        students = np.array(batch_students, dtype=np.int64)[found]
+        code_chunks.append(students * n_key + pos[found])
+        letter_chunks.append(np.array(batch_letters, dtype=np.int8)[found])
+
+        batch_students.clear()
+        batch_questions.clear()
+        batch_letters.clear()
+
+    for _, row in rows:
+        report["rows"] += 1
+
+        try:
+            student = row[col["student"]]
+            letter = row[col["answer"]].strip().upper()
+            if by_id:
+                question = int(row[col["question_id"]])
+            else:
+                question = (
+                    int(row[col["topic_number"]]) * _QUESTION_NUMBER_SPAN
+                    + int(row[col["question_number"]])
+                )
+        except (IndexError, ValueError):
+            report["errors"]["invalid_row"] = report["errors"].get("invalid_row", 0) + 1
+            continue
+
+        if letter and letter not in LETTER_INDEX:
+            report["errors"]["invalid_letter"] = report["errors"].get("invalid_letter", 0) + 1
+            continue
+
+        if student not in student_index:
+            student_index[student] = len(student_names)
+            student_names.append(student)
+
+        batch_students.append(student_index[student])
+        batch_questions.append(question)
+        # Sin responder: nunca coincide con la clave (-1 = sin opción correcta)
+        batch_letters.append(LETTER_INDEX.get(letter, -2))
+
+        if len(batch_students) >= GRADE_CHUNK_ROWS:
+            flush()
+
+    flush()
+
+    codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, np.int64)
+    letters = np.concatenate(letter_chunks) if letter_chunks else np.empty(0, np.int8)
+    codes, letters, duplicates = _keep_last_answer(codes, letters)
+    if duplicates:
+        report["errors"]["duplicate_answer"] = duplicates
+    report["graded"] = len(codes)
+
+    totals = _grade_answers(key, codes // n_key, codes % n_key, letters)
+
+    # Total = nº de preguntas del tema, como en la app
+    topic_ids, topic_sizes = np.unique(key["topic_id"], return_counts=True)
+    topic_size = dict(zip(topic_ids.tolist(), topic_sizes.tolist()))
+    topic_subject = dict(zip(key["topic_id"].tolist(), key["subject_id"].tolist()))
+
+    scores = [
+        {
+            "student": student_names[student],
+            "subject_id": topic_subject[topic_id],
+            "topic_id": topic_id,
+            "score": n_hits,
+            "total": topic_size[topic_id],
+        }
+        for (student, topic_id), n_hits in sorted(totals.items())
+    ]
+
+    return scores, report
+
+
+# ---------------------- SALIDA ---------------------- #
+
+
+def write_scores(scores, output_path: str):
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["student", "subject_id", "topic_id", "score", "total"])
+        for s in scores:
+            writer.writerow(
+                [s["student"], s["subject_id"], s["topic_id"], s["score"], s["total"]]
+            )
+
+
+def insert_scores(scores):
+    """
+    Guarda las notas en quiz_result (una fila por alumno y tema, con el
+    alumno en user_email) y actualiza los resúmenes, en una transacción.
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+    day = cur.execute("SELECT date('now', 'localtime')").fetchone()[0]
+
+    cur.executemany(
+        """
+        INSERT INTO quiz_result (subject_id, topic_id, score, total_questions, user_email)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (s["subject_id"], s["topic_id"], s["score"], s["total"], s["student"])
+            for s in scores
+        ],
+    )
+    for s in scores:
+        add_result_to_rollups(
+            cur, day, s["subject_id"], s["topic_id"], s["score"], s["total"]
+        )
+
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Corrige hojas de respuestas (papel/LMS) en bloque."
+    )
+    parser.add_argument("csv_path", help="CSV con student;question_id;answer")
+    parser.add_argument("output_path", help="CSV de salida con las notas.")
+    parser.add_argument(
+        "--subject",
+        type=int,
+        help="Id de asignatura, si las preguntas vienen como topic_number + question_number.",
+    )
+    parser.add_argument(
+        "--insert-results",
+        action="store_true",
+        help="Guardar también las notas en quiz_result.",
+    )
+    args = parser.parse_args()
+
+    try:
+        scores, report = grade_answer_sheets(args.csv_path, args.subject)
+    except ValueError as exc:
+        parser.error(str(exc))
+    write_scores(scores, args.output_path)
+
+    if args.insert_results:
+        insert_scores(scores)
+
+    print(f"✅ Respuestas leídas: {report['rows']}, corregidas: {report['graded']}")
+    for error, count in report["errors"].items():
+        print(f"   ⚠️ {error}: {count}")
+    print(f"   Notas escritas en {args.output_path}: {len(scores)}")
+
+
+if __name__ == "__main__":
+    main()
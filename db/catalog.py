@@ -0,0 +1,232 @@
+import mmap
+import os
+import struct
+import threading
+
+from .create_db import content_generation, get_connection
+
+# Dónde se publican los catálogos. En producción conviene un tmpfs
+# (p. ej. /dev/shm/fpquiz) para que ni siquiera la primera lectura toque disco.
+CATALOG_DIR = os.environ.get(
+    "QUIZ_CATALOG_DIR", os.path.join(os.path.dirname(__file__), "cache")
+)
+
+# Formato del fichero (little-endian):
+#   cabecera | asignaturas (por nombre) | índice de asignaturas (por id)
+#   | temas (por asignatura, número) | índice de temas (por id) | textos UTF-8
+_MAGIC = b"FPQC"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQQII")  # magic, versión, inodo, mtime_ns, nº asig., nº temas
+_SUBJECT = struct.Struct("<qII")  # id, offset nombre, longitud nombre
+_TOPIC = struct.Struct("<qqiII")  # id, subject_id, número, offset título, longitud título
+_INDEX = struct.Struct("<qI")  # id, posición en la tabla
+
+_catalog_lock = threading.Lock()
+_catalog = None
+
+
+class Catalog:
+    """
+    Asignaturas y temas leídos directamente de un fichero mapeado en
+    memoria. Todos los procesos del servidor mapean el mismo fichero, así
+    que el sistema operativo comparte las páginas entre ellos.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, ino, mtime_ns, n_subjects, n_topics = _HEADER.unpack_from(
+            self._buf, 0
+        )
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Catálogo con formato desconocido: {path}")
+
+        self.generation = (ino, mtime_ns)
+        self._n_subjects = n_subjects
+        self._n_topics = n_topics
+
+        self._subjects_at = _HEADER.size
+        self._subject_index_at = self._subjects_at + n_subjects * _SUBJECT.size
+        self._topics_at = self._subject_index_at + n_subjects * _INDEX.size
+        self._topic_index_at = self._topics_at + n_topics * _TOPIC.size
+        self._strings_at = self._topic_index_at + n_topics * _INDEX.size
+
+    # ---------- acceso a bajo nivel ---------- #
+
+    def _text(self, offset: int, length: int) -> str:
+        start = self._strings_at + offset
+        return self._buf[start : start + length].decode("utf-8")
+
+    def _subject_row(self, pos: int):
+        return _SUBJECT.unpack_from(self._buf, self._subjects_at + pos * _SUBJECT.size)
+
+    def _topic_row(self, pos: int):
+        return _TOPIC.unpack_from(self._buf, self._topics_at + pos * _TOPIC.size)
+
+    def _find_in_index(self, index_at: int, count: int, wanted_id: int):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row_id, pos = _INDEX.unpack_from(self._buf, index_at + mid * _INDEX.size)
+            if row_id < wanted_id:
+                lo = mid + 1
+            elif row_id > wanted_id:
+                hi = mid
+            else:
+                return pos
+        return None
+
+    # ---------- consultas ---------- #
+
+    def subjects(self):
+        subjects = []
+        for pos in range(self._n_subjects):
+            subject_id, name_off, name_len = self._subject_row(pos)
+            subjects.append({"id": subject_id, "name": self._text(name_off, name_len)})
+        return subjects
+
+    def subject_name(self, subject_id: int):
+        if subject_id is None:
+            return None
+        pos = self._find_in_index(self._subject_index_at, self._n_subjects, subject_id)
+        if pos is None:
+            return None
+        _, name_off, name_len = self._subject_row(pos)
+        return self._text(name_off, name_len)
+
+    def topics_by_subject(self, subject_id: int):
+        if subject_id is None:
+            return []
+
+        # Los temas están ordenados por asignatura: búsqueda binaria del primero
+        lo, hi = 0, self._n_topics
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._topic_row(mid)[1] < subject_id:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        topics = []
+        for pos in range(lo, self._n_topics):
+            topic_id, topic_subject_id, number, title_off, title_len = self._topic_row(pos)
+            if topic_subject_id != subject_id:
+                break
+            topics.append(
+                {
+                    "id": topic_id,
+                    "number": number,
+                    "name": self._text(title_off, title_len),
+                }
+            )
+        return topics
+
+    def topic(self, topic_id: int):
+        if topic_id is None:
+            return None
+        pos = self._find_in_index(self._topic_index_at, self._n_topics, topic_id)
+        if pos is None:
+            return None
+        _, subject_id, number, title_off, title_len = self._topic_row(pos)
+        return {
+            "id": topic_id,
+            "subject_id": subject_id,
+            "number": number,
+            "name": self._text(title_off, title_len),
+        }
+
+
+def catalog_path(generation) -> str:
+    ino, mtime_ns = generation
+    return os.path.join(CATALOG_DIR, f"catalog-{ino}-{mtime_ns}.bin")
+
+
+def build_catalog(generation=None) -> str:
+    """
+    Genera el fichero de catálogo de la generación actual del contenido (si
+    no existe ya) y devuelve su ruta. Lo llama el importador al publicar y,
+    si hiciera falta, el primer proceso que lo necesite.
+    """
+    generation = generation or content_generation()
+    path = catalog_path(generation)
+    if os.path.exists(path):
+        return path
+
+    conn = get_connection()
+    subjects = conn.execute("SELECT id, name FROM subject ORDER BY name").fetchall()
+    topics = conn.execute(
+        "SELECT id, subject_id, number, title FROM topic ORDER BY subject_id, number, id"
+    ).fetchall()
+    conn.close()
+
+    strings = bytearray()
+
+    def add_text(text: str):
+        data = text.encode("utf-8")
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    out = bytearray(_HEADER.pack(_MAGIC, _VERSION, *generation, len(subjects), len(topics)))
+
+    for s in subjects:
+        out += _SUBJECT.pack(s["id"], *add_text(s["name"]))
+    for pos, s in sorted(enumerate(subjects), key=lambda item: item[1]["id"]):
+        out += _INDEX.pack(s["id"], pos)
+
+    for t in topics:
+        out += _TOPIC.pack(t["id"], t["subject_id"], t["number"], *add_text(t["title"]))
+    for pos, t in sorted(enumerate(topics), key=lambda item: item[1]["id"]):
+        out += _INDEX.pack(t["id"], pos)
+
+    out += strings
+
+    os.makedirs(CATALOG_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(out)
+    os.replace(tmp_path, path)
+
+    # Los catálogos de generaciones anteriores ya no se necesitan (los
+    # procesos que aún los tengan mapeados pueden seguir leyéndolos)
+    for name in os.listdir(CATALOG_DIR):
+        old_path = os.path.join(CATALOG_DIR, name)
+        if name.startswith("catalog-") and name.endswith(".bin") and old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                # Otro proceso lo ha borrado a la vez o, en Windows, aún lo
+                # tiene mapeado: se borrará en una publicación posterior
+                pass
+
+    return path
+
+
+def get_catalog() -> Catalog:
+    """
+    Catálogo de la generación actual, mapeado una vez por proceso.
+    """
+    global _catalog
+
+    generation = content_generation()
+    if _catalog is not None and _catalog.generation == generation:
+        return _catalog
+
+    with _catalog_lock:
+        if _catalog is None or _catalog.generation != generation:
+            _catalog = _open_catalog(generation)
+
+    return _catalog
+
+
+def _open_catalog(generation, attempts: int = 3) -> Catalog:
+    for attempt in range(attempts):
+        try:
+            return Catalog(build_catalog(generation))
+        except FileNotFoundError:
+            # El importador ha publicado otra generación (y borrado este
+            # catálogo) entre el stat y la apertura: se vuelve a mirar
+            if attempt == attempts - 1:
+                raise
+            generation = content_generation()
@@ -1,17 +1,402 @@
 import os
+import pathlib
+import re
 import sqlite3
+import threading
 
-# Ruta al archivo de base de datos SQLite
+# Ruta al archivo de base de datos SQLite (contenido: asignaturas, temas...)
 DB_PATH = os.path.join(os.path.dirname(__file__), "quizzes.db")
 
+# Resultados de los alumnos: van a otra base de datos para que las
+# escrituras nunca bloqueen las lecturas del contenido.
+RESULTS_DB_PATH = os.path.join(os.path.dirname(__file__), "results.db")
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Cómo se abre el contenido para servir la app:
+#   - "memory":    réplica en memoria cargada al arrancar (por defecto)
+#   - "immutable": el fichero en disco en solo lectura (mode=ro&immutable=1)
+#   - "rw":        conexión normal de lectura/escritura
+CONTENT_DB_MODE = os.environ.get("QUIZ_CONTENT_DB_MODE", "memory")
+
+# Preguntas y opciones de las asignaturas particionadas (un fichero por
+# asignatura). La tabla subject_shard de DB_PATH indica qué fichero usa cada
+# asignatura; las que no aparecen siguen dentro de DB_PATH.
+SHARDS_DIR = os.path.join(os.path.dirname(__file__), "shards")
+
+# Los ids de pregunta/opción de la asignatura N empiezan en N * SHARD_ID_SPAN,
+# así siguen siendo únicos aunque vivan en ficheros distintos.
+SHARD_ID_SPAN = 1_000_000_000
+
+_REPLICA_URI = "file:quizzes_replica_{}?mode=memory&cache=shared"
+
+_replica_lock = threading.Lock()
+# Conexión que mantiene viva la base de datos en memoria compartida
+_replica_keeper = None
+_replica_uri = None
+_replica_generation = None
+
+_SHARD_REPLICA_URI = "file:quizzes_shard_{}?mode=memory&cache=shared"
+# nombre de shard -> conexión que mantiene viva su réplica en memoria
+_shard_keepers = {}
+
+
+def get_connection(db_path=None):
+    conn = sqlite3.connect(db_path or DB_PATH)
     conn.row_factory = sqlite3.Row  # 👈 ESTO ES LO IMPORTANTE
     return conn
 
 
-def create_tables():
+def content_generation():
+    """
+    Identifica la versión actual del fichero de contenido.
+
+    El importador sustituye el fichero entero con un rename atómico, así que
+    basta con mirar el inodo y la fecha de modificación (un simple stat).
+    """
+    st = os.stat(DB_PATH)
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _content_uri(params: str) -> str:
+    return f"{pathlib.Path(DB_PATH).resolve().as_uri()}?{params}"
+
+
+def load_replica():
+    """
+    Copia el contenido de DB_PATH a una base de datos en memoria compartida
+    usando la API de backup de sqlite3. Se llama al arrancar y cada vez que
+    el importador publica una generación nueva.
+
+    Cada generación usa su propio nombre en memoria: las conexiones abiertas
+    siguen leyendo la anterior hasta que se cierran.
+    """
+    global _replica_keeper, _replica_uri, _replica_generation
+
+    with _replica_lock:
+        generation = content_generation()
+        if generation == _replica_generation:
+            return
+
+        uri = _REPLICA_URI.format("_".join(str(part) for part in generation))
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(_content_uri("mode=ro"), uri=True)
+        source.backup(keeper)
+        source.close()
+
+        if _replica_keeper is not None:
+            _replica_keeper.close()
+        for shard_keeper in _shard_keepers.values():
+            shard_keeper.close()
+        _shard_keepers.clear()
+        _replica_keeper = keeper
+        _replica_uri = uri
+        _replica_generation = generation
+
+
+def get_read_connection():
+    """
+    Conexión de solo lectura al contenido, según CONTENT_DB_MODE.
+
+    Es la que deben usar todas las consultas de la app; el importador sigue
+    usando `get_connection`.
+    """
+    if CONTENT_DB_MODE == "memory":
+        if _replica_generation != content_generation():
+            load_replica()
+        conn = sqlite3.connect(_replica_uri, uri=True)
+    elif CONTENT_DB_MODE == "immutable":
+        conn = sqlite3.connect(_content_uri("mode=ro&immutable=1"), uri=True)
+    else:
+        conn = sqlite3.connect(DB_PATH)
+
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# ---------------------- SHARDS POR ASIGNATURA ---------------------- #
+
+
+def shard_path(shard: str) -> str:
+    return os.path.join(SHARDS_DIR, shard)
+
+
+def get_subject_shard(conn, subject_id: int):
+    """
+    Devuelve el fichero de shard de una asignatura, o None si sus preguntas
+    están en la base de datos principal.
+    """
+    try:
+        row = conn.execute(
+            "SELECT shard FROM subject_shard WHERE subject_id = ?",
+            (subject_id,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Base de datos anterior a los shards
+        return None
+
+    return row[0] if row else None
+
+
+def _shard_location(shard: str, mode: str) -> str:
+    path = shard_path(shard)
+
+    if mode == "memory":
+        # Los ficheros de shard no se modifican nunca (cada importación crea
+        # uno con otro nombre), así que basta con cargar cada uno una vez.
+        with _replica_lock:
+            if shard not in _shard_keepers:
+                uri = _SHARD_REPLICA_URI.format(os.path.splitext(shard)[0])
+                keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                source = sqlite3.connect(
+                    f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True
+                )
+                source.backup(keeper)
+                source.close()
+                _shard_keepers[shard] = keeper
+        return _SHARD_REPLICA_URI.format(os.path.splitext(shard)[0])
+
+    if mode == "immutable":
+        return f"{pathlib.Path(path).resolve().as_uri()}?mode=ro&immutable=1"
+
+    return path
+
+
+def attach_shard(conn, shard: str, mode=None) -> str:
+    """
+    Adjunta (ATTACH) el shard a la conexión si no lo estaba ya y devuelve el
+    nombre de esquema con el que hay que consultarlo.
+
+    `mode` es el de la conexión: por defecto CONTENT_DB_MODE (conexiones de
+    `get_read_connection`); para conexiones de `get_connection` usar "rw".
+    """
+    alias = "shard_" + re.sub(r"\W", "_", os.path.splitext(shard)[0])
+
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if alias not in attached:
+        location = _shard_location(shard, mode or CONTENT_DB_MODE)
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (location,))
+
+    return alias
+
+
+def questions_schema(conn, subject_id: int, mode=None) -> str:
+    """
+    Esquema donde están las preguntas de una asignatura: "main" o el alias
+    de su shard (que se adjunta en ese momento).
+    """
+    shard = get_subject_shard(conn, subject_id)
+    if shard is None:
+        return "main"
+    return attach_shard(conn, shard, mode)
+
+
+def create_shard_tables(db_path: str, subject_id: int):
+    """
+    Crea un fichero de shard vacío para una asignatura. Usa el mismo esquema
+    que la base de datos principal (solo se rellenan question y option) y
+    arranca los AUTOINCREMENT en subject_id * SHARD_ID_SPAN.
+    """
+    create_tables(db_path)
+
+    conn = get_connection(db_path)
+    start = subject_id * SHARD_ID_SPAN
+    conn.executemany(
+        "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+        [("question", start), ("option", start)],
+    )
+    conn.commit()
+    conn.close()
+
+
+# ---------------------- RESULTADOS ---------------------- #
+
+
+def get_results_connection():
+    """
+    Conexión de lectura/escritura a la base de datos de resultados.
+    Crea las tablas si no existen.
+    """
+    conn = sqlite3.connect(RESULTS_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    create_results_tables(conn)
+    return conn
+
+
+def create_results_tables(conn):
+    """
+    Crea las tablas de resultados si no existen.
+    Estructura:
+      - quiz_result(id, subject_id, topic_id, score, total_questions, created_at,
+                    user_email)
+      - quiz_answer(result_id, question_id, option_id, is_correct)
+      - item_stats / option_stats (análisis de preguntas)
+      - quiz_result_daily(day, subject_id, topic_id, attempts, score_sum,
+                          total_sum, passed)
+      - quiz_result_daily_bucket(day, subject_id, topic_id, bucket, attempts)
+      - topic_score_hist(topic_id, pct, attempts)
+      - quiz_checkpoint(user_email, attempt_id, subject_id, topic_id,
+                        quiz_seed, answers, updated_at)
+
+    Las tablas *_daily (resúmenes por día) y topic_score_hist (histograma
+    histórico por tema) se mantienen al guardar cada resultado (ver
+    db/rollups.py).
+
+    Si quiz_result se crea nueva, se copian los resultados que hubiera en la
+    base de datos de contenido (donde se guardaban antes).
+    """
+    cur = conn.cursor()
+
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'quiz_result'"
+    )
+    if cur.fetchone() is None:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS quiz_result (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject_id INTEGER,
+                topic_id INTEGER,
+                score INTEGER,
+                total_questions INTEGER,
+                created_at TEXT DEFAULT (datetime('now','localtime'))
+            )
+            """
+        )
+        _migrate_legacy_results(cur)
+
+    # Columnas añadidas después de crear la tabla
+    columns = {r[1] for r in cur.execute("PRAGMA table_info(quiz_result)")}
+    if "user_email" not in columns:
+        cur.execute("ALTER TABLE quiz_result ADD COLUMN user_email TEXT")
+
+    # Respuesta elegida en cada pregunta de cada intento (para el análisis
+    # de preguntas). option_id es NULL si la pregunta se dejó en blanco.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quiz_answer (
+            result_id   INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            option_id   INTEGER,
+            is_correct  INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (result_id, question_id),
+            FOREIGN KEY(result_id) REFERENCES quiz_result(id)
+        )
+        """
+    )
+
+    # Resultado del análisis de preguntas (db/item_analysis.py)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS item_stats (
+            question_id    INTEGER PRIMARY KEY,
+            subject_id     INTEGER NOT NULL,
+            topic_id       INTEGER NOT NULL,
+            attempts       INTEGER NOT NULL,
+            difficulty     REAL,
+            discrimination REAL,
+            updated_at     TEXT NOT NULL
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS option_stats (
+            option_id   INTEGER PRIMARY KEY,
+            question_id INTEGER NOT NULL,
+            subject_id  INTEGER NOT NULL,
+            is_correct  INTEGER NOT NULL,
+            picks       INTEGER NOT NULL,
+            pick_rate   REAL,
+            mean_score  REAL
+        )
+        """
+    )
+
+    # Resumen diario por asignatura y tema
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quiz_result_daily (
+            day        TEXT    NOT NULL,
+            subject_id INTEGER NOT NULL,
+            topic_id   INTEGER NOT NULL,
+            attempts   INTEGER NOT NULL DEFAULT 0,
+            score_sum  INTEGER NOT NULL DEFAULT 0,
+            total_sum  INTEGER NOT NULL DEFAULT 0,
+            passed     INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, day, topic_id)
+        )
+        """
+    )
+
+    # Histograma diario de notas (bucket = décima parte del porcentaje)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quiz_result_daily_bucket (
+            day        TEXT    NOT NULL,
+            subject_id INTEGER NOT NULL,
+            topic_id   INTEGER NOT NULL,
+            bucket     INTEGER NOT NULL,
+            attempts   INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, day, topic_id, bucket)
+        )
+        """
+    )
+
+    # Histograma histórico por tema: nº de intentos por porcentaje (0-100)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS topic_score_hist (
+            topic_id INTEGER NOT NULL,
+            pct      INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (topic_id, pct)
+        )
+        """
+    )
+
+    # Cuestionarios a medio hacer (respuestas en JSON), para poder
+    # retomarlos tras un reinicio del servidor
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quiz_checkpoint (
+            user_email TEXT    NOT NULL,
+            attempt_id TEXT    NOT NULL,
+            subject_id INTEGER,
+            topic_id   INTEGER,
+            quiz_seed  INTEGER,
+            answers    TEXT    NOT NULL DEFAULT '{}',
+            updated_at TEXT    NOT NULL,
+            PRIMARY KEY (user_email, attempt_id)
+        )
+        """
+    )
+
+    conn.commit()
+
+
+def _migrate_legacy_results(cur):
+    if not os.path.exists(DB_PATH):
+        return
+
+    cur.execute("ATTACH DATABASE ? AS legacy", (DB_PATH,))
+    cur.execute(
+        "SELECT 1 FROM legacy.sqlite_master "
+        "WHERE type = 'table' AND name = 'quiz_result'"
+    )
+    if cur.fetchone() is not None:
+        cur.execute(
+            """
+            INSERT INTO quiz_result
+                (id, subject_id, topic_id, score, total_questions, created_at)
+            SELECT id, subject_id, topic_id, score, total_questions, created_at
+            FROM legacy.quiz_result
+            """
+        )
+    cur.connection.commit()
+    cur.execute("DETACH DATABASE legacy")
+
+
+def create_tables(db_path=None):
     """
     Crea las tablas necesarias si no existen.
     Estructura:
@@ -19,8 +404,15 @@ def create_tables():
       - topic(id, subject_id, number, title)
       - question(id, topic_id, number, text)
       - option(id, question_id, text, is_correct)
+      - subject_shard(subject_id, shard)
+      - question_read(topic_id, number, question_id, text, options)
+
+    question_read es una copia desnormalizada de question + option (una
+    fila por pregunta, opciones en JSON) que mantiene el importador para
+    leer un tema con un único recorrido por rango. Las tablas normalizadas
+    siguen siendo la fuente de verdad.
     """
-    conn = get_connection()
+    conn = get_connection(db_path)
     cur = conn.cursor()
 
     # Tabla de asignaturas
@@ -72,5 +464,30 @@ def create_tables():
         """
     )
 
+    # Modelo de lectura: preguntas de un tema contiguas en disco
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS question_read (
+            topic_id    INTEGER NOT NULL,
+            number      INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            text        TEXT NOT NULL,
+            options     TEXT NOT NULL,
+            PRIMARY KEY (topic_id, number, question_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+    # Manifiesto de shards: asignatura -> fichero con sus preguntas
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subject_shard (
+            subject_id INTEGER PRIMARY KEY,
+            shard      TEXT NOT NULL,
+            FOREIGN KEY(subject_id) REFERENCES subject(id)
+        )
+        """
+    )
+
     conn.commit()
     conn.close()
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import gzip
+import json
+
+from .create_db import get_connection, get_results_connection, questions_schema
+
+CSV_HEADER = [
+    "subject",
+    "topic_number",
+    "topic_title",
+    "question_number",
+    "question_text",
+    "option_a",
+    "option_b",
+    "option_c",
+    "option_d",
+    "correct_option",
+]
+
+
+def _open_output(path: str, use_gzip: bool = False):
+    """
+    Abre el fichero de salida en modo texto, comprimido con gzip si se pide
+    (o si la ruta termina en .gz).
+    """
+    if use_gzip or path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def iter_question_rows(conn):
+    """
+    Recorre el banco de preguntas con un único cursor y devuelve una fila
+    por pregunta en el mismo formato que acepta `import_from_csv`.
+
+    Las opciones llegan consecutivas (ordenadas por id), así que basta con
+    ir acumulando las de la pregunta actual: la memoria no depende del
+    tamaño de la base de datos.
+    """
+    subject_ids = [r[0] for r in conn.execute("SELECT id FROM subject ORDER BY id")]
+
+    for subject_id in subject_ids:
+        yield from _iter_subject_question_rows(conn, subject_id)
+
+
+def _iter_subject_question_rows(conn, subject_id: int):
+    # Las preguntas pueden estar en el shard de la asignatura
+    schema = questions_schema(conn, subject_id, mode="rw")
+
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT
+            s.name   AS subject_name,
+            t.number AS topic_number,
+            t.title  AS topic_title,
+            q.id     AS question_id,
+            q.number AS question_number,
+            q.text   AS question_text,
+            o.text   AS option_text,
+            o.is_correct
+        FROM {schema}.question q
+        JOIN topic t   ON q.topic_id = t.id
+        JOIN subject s ON t.subject_id = s.id
+        LEFT JOIN {schema}.option o ON o.question_id = q.id
+        WHERE s.id = ?
+        ORDER BY t.number, q.number, q.id, o.id
+        """,
+        (subject_id,),
+    )
+
+    current_id = None
+    current = None
+    options = []
+    correct_letter = ""
+
+    def build_row():
+        padded = (options + [""] * 4)[:4]
+        return [
+            current["subject_name"],
+            current["topic_number"],
+            current["topic_title"],
+            current["question_number"],
+            current["question_text"],
+            *padded,
+            correct_letter,
+        ]
+
+    for row in cur:
+        if row["question_id"] != current_id:
+            if current is not None:
+                yield build_row()
+            current_id = row["question_id"]
+            current = row
+            options = []
+            correct_letter = ""
+
+        if row["option_text"] is None:
+            continue
+
+        if row["is_correct"] and not correct_letter:
+            correct_letter = chr(ord("A") + len(options))
+        options.append(row["option_text"])
+
+    if current is not None:
+        yield build_row()
+
+
+def export_questions(output_path: str, use_gzip: bool = False):
+    """
+    Exporta asignaturas, temas, preguntas y opciones a un CSV separado por
+    ';' que se puede volver a importar con `import_from_csv`.
+    """
+    conn = get_connection()
+    total = 0
+
+    with _open_output(output_path, use_gzip) as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(CSV_HEADER)
+
+        for row in iter_question_rows(conn):
+            writer.writerow(row)
+            total += 1
+
+    conn.close()
+    return total
+
+
+def export_results(output_path: str, use_gzip: bool = False):
+    """
+    Exporta la tabla quiz_result en formato JSON Lines (un objeto por línea).
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+    total = 0
+
+    with _open_output(output_path, use_gzip) as f:
+        cur.execute("SELECT * FROM quiz_result ORDER BY id")
+        for row in cur:
+            f.write(json.dumps(dict(row), ensure_ascii=False))
+            f.write("\n")
+            total += 1
+
+    conn.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta datos de quizzes.db.")
+    parser.add_argument("what", choices=["questions", "results"])
+    parser.add_argument("output_path")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir con gzip.")
+    args = parser.parse_args()
+
+    if args.what == "questions":
+        total = export_questions(args.output_path, args.gzip)
+        print(f"✅ Preguntas exportadas: {total} -> {args.output_path}")
+    else:
+        total = export_results(args.output_path, args.gzip)
+        print(f"✅ Resultados exportados: {total} -> {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
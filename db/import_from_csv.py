@@ -1,101 +1,503 @@
+import argparse
+import codecs
+import contextlib
+import csv
+import json
 import os
+import sqlite3
+import time
 
-from .create_db import get_connection, create_tables
+from . import create_db
+from .catalog import build_catalog
+from .create_db import (
+    get_connection,
+    create_tables,
+    create_shard_tables,
+    get_results_connection,
+    shard_path,
+    SHARD_ID_SPAN,
+)
 
 CSV_PATH = os.path.join(os.path.dirname(__file__), "quizzes.csv")
 
+# Tamaño de la muestra (en bytes) que se usa para detectar codificación y
+# dialecto. Nunca se lee el fichero entero para esto.
+SNIFF_SAMPLE_BYTES = 64 * 1024
 
-def import_from_csv():
-    print(f"📂 Importando datos desde: {CSV_PATH}")
+# Nº máximo de líneas de ejemplo que se guardan por tipo de error en el informe
+REPORT_SAMPLE_LINES = 10
 
-    # Crear tablas si no existen
-    create_tables()
-    conn = get_connection()
-    cur = conn.cursor()
+EXPECTED_COLUMNS = 10
 
-    # Borrar datos existentes
-    cur.execute("DELETE FROM option")
-    cur.execute("DELETE FROM question")
-    cur.execute("DELETE FROM topic")
-    cur.execute("DELETE FROM subject")
-    conn.commit()
 
-    subject_ids = {}
-    topic_ids = {}
+# ---------------------- LECTURA DEL CSV ---------------------- #
 
-    total_subjects = 0
-    total_topics = 0
-    total_questions = 0
-    total_options = 0
 
-    # Leer todas las líneas del CSV
-    with open(CSV_PATH, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+class _SemicolonDialect(csv.excel):
+    delimiter = ";"
 
-    if not lines:
-        print("⚠️ El CSV está vacío.")
-        conn.close()
+
+def sniff_csv(csv_path: str = CSV_PATH, sample_bytes: int = SNIFF_SAMPLE_BYTES):
+    """
+    Detecta la codificación y el dialecto del CSV a partir de los primeros
+    `sample_bytes` bytes del fichero.
+
+    Devuelve (encoding, dialect).
+    """
+    with open(csv_path, "rb") as f:
+        sample = f.read(sample_bytes)
+
+    # BOM explícito: no hace falta adivinar
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    else:
+        try:
+            sample.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError as exc:
+            # Si solo falla el último carácter es que la muestra lo ha cortado
+            if exc.start >= len(sample) - 3:
+                encoding = "utf-8"
+            else:
+                import chardet
+
+                encoding = chardet.detect(sample)["encoding"] or "utf-8"
+
+    text = sample.decode(encoding, errors="ignore")
+    # Nos quedamos solo con líneas completas
+    if "\n" in text:
+        text = text[: text.rfind("\n") + 1]
+
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=";,\t")
+    except csv.Error:
+        dialect = _SemicolonDialect
+
+    # El Sniffer no acierta bien con las comillas: a veces toma por comilla
+    # un apóstrofo del texto, y tampoco detecta bien las dobladas ("")
+    dialect.quotechar = '"'
+    dialect.doublequote = True
+
+    return encoding, dialect
+
+
+def iter_csv_rows(csv_path: str = CSV_PATH, encoding=None, dialect=None):
+    """
+    Recorre el CSV una sola vez (sin cargarlo en memoria) y va devolviendo
+    tuplas (número_de_línea, campos).
+
+    Algunas exportaciones entrecomillan la línea entera
+    ("asignatura;1;tema;...;B"). En ese caso la línea llega como un único
+    campo y se vuelve a separar por ';'.
+    """
+    if encoding is None or dialect is None:
+        sniffed_encoding, sniffed_dialect = sniff_csv(csv_path)
+        encoding = encoding or sniffed_encoding
+        dialect = dialect or sniffed_dialect
+
+    with open(csv_path, "r", encoding=encoding, errors="replace", newline="") as f:
+        reader = csv.reader(f, dialect)
+        line_number = 1
+
+        for row in reader:
+            if len(row) == 1 and ";" in row[0]:
+                # Respetando las comillas de dentro ("texto; con punto y coma")
+                row = next(csv.reader([row[0]], delimiter=";"))
+
+            yield line_number, [col.strip() for col in row]
+            line_number = reader.line_num + 1
+
+
+def parse_row(row):
+    """
+    Valida una fila ya separada en campos.
+
+    Devuelve (registro, tipo_error). `tipo_error` es None si la fila es
+    válida, "invalid_correct_option" si se puede importar pero sin opción
+    correcta, o el motivo por el que hay que descartarla.
+    """
+    if not any(row):
+        return None, "empty_line"
+
+    if len(row) < EXPECTED_COLUMNS:
+        return None, "incomplete_row"
+
+    # Columnas de más con contenido: algún ';' sin entrecomillar ha
+    # desplazado los campos
+    if any(row[EXPECTED_COLUMNS:]):
+        return None, "too_many_columns"
+
+    if any("\ufffd" in col for col in row):
+        return None, "encoding_error"
+
+    (
+        subject_name,
+        topic_number_str,
+        topic_title,
+        question_number_str,
+        question_text,
+        option_a,
+        option_b,
+        option_c,
+        option_d,
+        correct_letter,
+    ) = row[:EXPECTED_COLUMNS]
+
+    # Parsear números de tema y pregunta
+    try:
+        topic_number = int(topic_number_str)
+        question_number = int(question_number_str)
+    except ValueError:
+        return None, "invalid_number"
+
+    record = {
+        "subject_name": subject_name,
+        "topic_number": topic_number,
+        "topic_title": topic_title,
+        "question_number": question_number,
+        "question_text": question_text,
+        "options": [option_a, option_b, option_c, option_d],
+        "correct_letter": correct_letter.strip().upper(),
+    }
+
+    if record["correct_letter"] not in {"A", "B", "C", "D"}:
+        return record, "invalid_correct_option"
+
+    return record, None
+
+
+# ---------------------- VALIDACIÓN (DRY RUN) ---------------------- #
+
+
+def validate_csv(csv_path: str = CSV_PATH, report_path=None):
+    """
+    Valida el CSV sin tocar la base de datos y devuelve un informe compacto:
+    nº de filas por resultado, recuento por tipo de error y algunas líneas
+    de ejemplo de cada tipo.
+
+    Si se indica `report_path`, el informe se guarda además en JSON.
+    """
+    encoding, dialect = sniff_csv(csv_path)
+
+    report = {
+        "csv_path": csv_path,
+        "encoding": encoding,
+        "delimiter": dialect.delimiter,
+        "rows_total": 0,
+        "rows_ok": 0,
+        "rows_with_warnings": 0,
+        "rows_rejected": 0,
+        "errors": {},
+    }
+
+    rows = iter_csv_rows(csv_path, encoding, dialect)
+
+    # Saltamos la cabecera
+    next(rows, None)
+
+    for line_number, row in rows:
+        report["rows_total"] += 1
+        record, error = parse_row(row)
+
+        if error is None:
+            report["rows_ok"] += 1
+            continue
+
+        if record is not None:
+            report["rows_with_warnings"] += 1
+        else:
+            report["rows_rejected"] += 1
+
+        entry = report["errors"].setdefault(error, {"count": 0, "sample_lines": []})
+        entry["count"] += 1
+        if len(entry["sample_lines"]) < REPORT_SAMPLE_LINES:
+            entry["sample_lines"].append(line_number)
+
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+# ---------------------- IMPORTACIÓN ---------------------- #
+
+
+def import_from_csv(
+    csv_path: str = CSV_PATH,
+    shard_by_subject: bool = False,
+    only_subject=None,
+):
+    """
+    Importa el CSV sin tocar la base de datos en uso: se construye un
+    fichero nuevo junto a DB_PATH, se verifica y se sustituye con un rename
+    atómico. Las apps en marcha ven la generación nueva en su siguiente
+    petición y nunca una base de datos a medio importar.
+
+    - `shard_by_subject`: las preguntas de cada asignatura van a su propio
+      fichero en SHARDS_DIR y DB_PATH queda como manifiesto (asignaturas,
+      temas y tabla subject_shard).
+    - `only_subject`: reimporta solo esa asignatura (en su shard) y deja el
+      resto como está. Varias asignaturas se pueden importar en paralelo.
+    """
+    print(f"📂 Importando datos desde: {csv_path}")
+
+    if only_subject is not None:
+        totals = _import_subject(csv_path, only_subject)
+    elif shard_by_subject:
+        totals = _import_sharded(csv_path)
+    else:
+        totals = _import_single(csv_path)
+
+    if totals is None:
         return
 
+    print("✅ Importación terminada.")
+    print(f"   Asignaturas insertadas: {totals['subject']}")
+    print(f"   Temas insertados:       {totals['topic']}")
+    print(f"   Preguntas insertadas:   {totals['question']}")
+    print(f"   Opciones insertadas:    {totals['option']}")
+
+
+def _iter_records(csv_path: str):
+    """
+    Recorre el CSV y devuelve (registro, [is_correct_a, ..., is_correct_d])
+    por cada fila importable, avisando de las que se saltan.
+
+    Devuelve None si el CSV está vacío.
+    """
+    rows = iter_csv_rows(csv_path)
+
     # Saltamos la cabecera (línea 1)
-    for line_number, raw_line in enumerate(lines[1:], start=2):
-        raw_line = raw_line.strip()
-        if not raw_line:
-            # Línea vacía
-            print(f"↩️ Saltando línea {line_number}: línea vacía")
-            continue
+    if next(rows, None) is None:
+        print("⚠️ El CSV está vacío. No se modifica la base de datos.")
+        return None
 
-        # Separar por ';'
-        row = raw_line.split(";")
+    return _records_from_rows(rows)
 
-        if len(row) < 10:
-            print(f"↩️ Saltando línea {line_number}: fila incompleta -> {row}")
-            continue
 
-        # Limpiar espacios y comillas dobles alrededor de cada campo
-        row = [col.strip().strip('"') for col in row]
-
-        (
-            subject_name,
-            topic_number_str,
-            topic_title,
-            question_number_str,
-            question_text,
-            option_a,
-            option_b,
-            option_c,
-            option_d,
-            correct_letter,
-            *rest,
-        ) = row
-
-        # Parsear números de tema y pregunta
-        try:
-            topic_number = int(topic_number_str)
-            question_number = int(question_number_str)
-        except ValueError:
-            print(
-                f"↩️ Saltando línea {line_number}: número de tema/pregunta inválido -> "
-                f"topic_number='{topic_number_str}', question_number='{question_number_str}'"
-            )
+def _records_from_rows(rows):
+    for line_number, row in rows:
+        record, error = parse_row(row)
+
+        if record is None:
+            print(f"↩️ Saltando línea {line_number}: {error} -> {row}")
             continue
 
-        # Normalizar letra correcta
-        correct_letter_clean = correct_letter.strip().upper()
+        correct_letter_clean = record["correct_letter"]
 
-        if correct_letter_clean not in {"A", "B", "C", "D"}:
+        if error == "invalid_correct_option":
             print(
-                f"⚠️ Línea {line_number}: opción correcta '{correct_letter}' inválida "
-                f"(normalizada: '{correct_letter_clean}'). "
+                f"⚠️ Línea {line_number}: opción correcta '{correct_letter_clean}' inválida. "
                 "Se insertan opciones sin marcar correcta. "
                 f"Fila: {row}"
             )
-            is_correct_a = is_correct_b = is_correct_c = is_correct_d = 0
+            flags = [0, 0, 0, 0]
         else:
-            is_correct_a = 1 if correct_letter_clean == "A" else 0
-            is_correct_b = 1 if correct_letter_clean == "B" else 0
-            is_correct_c = 1 if correct_letter_clean == "C" else 0
-            is_correct_d = 1 if correct_letter_clean == "D" else 0
+            flags = [1 if correct_letter_clean == letter else 0 for letter in "ABCD"]
+
+        yield record, flags
+
+
+def _insert_question(cur, topic_id: int, record, flags):
+    cur.execute(
+        """
+        INSERT INTO question (topic_id, number, text)
+        VALUES (?, ?, ?)
+        """,
+        (topic_id, record["question_number"], record["question_text"]),
+    )
+    question_id = cur.lastrowid
+
+    cur.executemany(
+        """
+        INSERT INTO option (question_id, text, is_correct)
+        VALUES (?, ?, ?)
+        """,
+        [
+            (question_id, option_text, is_correct)
+            for option_text, is_correct in zip(record["options"], flags)
+        ],
+    )
+
+
+def _build_read_model(conn):
+    """
+    Rellena question_read a partir de question y option: una fila por
+    pregunta con sus opciones empaquetadas como JSON [[id, texto, correcta]].
+    """
+    conn.execute("DELETE FROM question_read")
+    conn.execute(
+        """
+        INSERT INTO question_read (topic_id, number, question_id, text, options)
+        SELECT
+            q.topic_id,
+            q.number,
+            q.id,
+            q.text,
+            (
+                SELECT json_group_array(json_array(o.id, o.text, o.is_correct))
+                FROM (
+                    SELECT id, text, is_correct
+                    FROM option
+                    WHERE question_id = q.id
+                    ORDER BY id
+                ) o
+            )
+        FROM question q
+        """
+    )
+
+
+def _ensure_read_model(conn):
+    """
+    Rellena question_read si no está al día con question (manifiesto
+    importado antes de existir el modelo de lectura, donde create_tables
+    acaba de crear la tabla vacía).
+    """
+    n_questions = conn.execute("SELECT COUNT(*) FROM question").fetchone()[0]
+    n_read = conn.execute("SELECT COUNT(*) FROM question_read").fetchone()[0]
+    if n_questions != n_read:
+        _build_read_model(conn)
+
+
+def _open_build_connection(db_path: str):
+    conn = get_connection(db_path)
+    # Es un fichero temporal: si algo falla se descarta entero
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def _tmp_path(path: str) -> str:
+    return f"{path}.tmp-{os.getpid()}"
+
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ---------- Continuidad de ids ---------- #
+#
+# Cada importación construye ficheros nuevos, pero los ids de AUTOINCREMENT
+# tienen que seguir creciendo respecto al contenido publicado: los
+# resultados (quiz_answer, option_stats, quiz_checkpoint...) guardan ids de
+# preguntas y opciones, y un id reutilizado apuntaría a otra fila.
+
+
+def _read_sequences(db_path: str):
+    """
+    Últimos ids usados (sqlite_sequence) de una base de datos, o {} si no
+    existe.
+    """
+    if not os.path.exists(db_path):
+        return {}
+
+    conn = get_connection(db_path)
+    try:
+        rows = conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    return {r["name"]: r["seq"] for r in rows}
+
+
+def _published_shards(db_path: str):
+    """
+    subject_id -> ruta del shard que usa cada asignatura en el manifiesto
+    publicado.
+    """
+    if not os.path.exists(db_path):
+        return {}
+
+    conn = get_connection(db_path)
+    try:
+        rows = conn.execute("SELECT subject_id, shard FROM subject_shard").fetchall()
+    except sqlite3.OperationalError:
+        # Manifiesto anterior a los shards
+        rows = []
+    finally:
+        conn.close()
+    return {r["subject_id"]: shard_path(r["shard"]) for r in rows}
+
+
+def _published_sequences(db_path: str):
+    """
+    Máximo id usado por tabla entre el manifiesto publicado y todos sus
+    shards.
+    """
+    sequences = _read_sequences(db_path)
+    for path in _published_shards(db_path).values():
+        for name, seq in _read_sequences(path).items():
+            sequences[name] = max(seq, sequences.get(name, 0))
+    return sequences
+
+
+def _seed_sequences(conn, sequences):
+    """
+    Hace que los próximos ids de `conn` empiecen después de `sequences`
+    (sin bajar los que ya tenga).
+    """
+    for name, seq in sequences.items():
+        cur = conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+            (seq, name),
+        )
+        if cur.rowcount == 0:
+            conn.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                (name, seq),
+            )
+
+
+# ---------- Base de datos única ---------- #
+
+
+def _import_single(csv_path: str):
+    db_path = create_db.DB_PATH
+    tmp_path = _tmp_path(db_path)
+    _remove_if_exists(tmp_path)
+
+    try:
+        totals = _build_database(csv_path, tmp_path, _published_sequences(db_path))
+        if totals is None:
+            return None
+
+        _verify_database(tmp_path, totals)
+
+        with _manifest_lock(db_path):
+            _publish_manifest(tmp_path, db_path)
+            # Ya ninguna asignatura usa shards
+            _remove_unused_shards(db_path)
+    finally:
+        _remove_if_exists(tmp_path)
+
+    return totals
+
+
+def _build_database(csv_path: str, db_path: str, sequences=None):
+    """
+    Crea las tablas en `db_path` (un fichero nuevo) y carga el CSV, con los
+    ids a continuación de `sequences` (últimos ids publicados por tabla).
+    Devuelve el nº de filas insertadas por tabla, o None si el CSV está vacío.
+    """
+    records = _iter_records(csv_path)
+    if records is None:
+        return None
+
+    create_tables(db_path)
+    conn = _open_build_connection(db_path)
+    _seed_sequences(conn, sequences or {})
+    cur = conn.cursor()
+
+    subject_ids = {}
+    topic_ids = {}
+    totals = {"subject": 0, "topic": 0, "question": 0, "option": 0}
+
+    for record, flags in records:
+        subject_name = record["subject_name"]
 
         # Insertar subject si no existe
         if subject_name not in subject_ids:
@@ -103,65 +505,490 @@ def import_from_csv():
                 "INSERT INTO subject (name) VALUES (?)",
                 (subject_name,),
             )
-            subject_id = cur.lastrowid
-            subject_ids[subject_name] = subject_id
-            total_subjects += 1
-        else:
-            subject_id = subject_ids[subject_name]
-
-        # Clave del tema
-        topic_key = (subject_name, topic_number)
+            subject_ids[subject_name] = cur.lastrowid
+            totals["subject"] += 1
 
         # Insertar topic si no existe
+        topic_key = (subject_name, record["topic_number"])
         if topic_key not in topic_ids:
             cur.execute(
                 """
                 INSERT INTO topic (subject_id, number, title)
                 VALUES (?, ?, ?)
                 """,
-                (subject_id, topic_number, topic_title),
+                (subject_ids[subject_name], record["topic_number"], record["topic_title"]),
             )
-            topic_id = cur.lastrowid
-            topic_ids[topic_key] = topic_id
-            total_topics += 1
-        else:
-            topic_id = topic_ids[topic_key]
+            topic_ids[topic_key] = cur.lastrowid
+            totals["topic"] += 1
+
+        _insert_question(cur, topic_ids[topic_key], record, flags)
+        totals["question"] += 1
+        totals["option"] += len(flags)
 
-        # Insertar question
+    _build_read_model(conn)
+    totals["question_read"] = totals["question"]
+
+    conn.commit()
+    conn.close()
+
+    return totals
+
+
+# ---------- Shards por asignatura ---------- #
+
+
+def _shard_topic_id(subject_id: int, topic_number: int) -> int:
+    # En modo shards el id del tema se deriva de la asignatura: así un shard
+    # se puede construir sin consultar el manifiesto.
+    return subject_id * SHARD_ID_SPAN + topic_number
+
+
+def _build_shards(csv_path: str, subject_ids, only_subject=None):
+    """
+    Carga las preguntas del CSV en un shard temporal por asignatura.
+
+    `subject_ids` (nombre -> id) se completa con las asignaturas nuevas,
+    salvo con `only_subject`, en cuyo caso solo se importa esa.
+
+    Devuelve (shards, topics) o None si el CSV está vacío:
+      - shards: subject_id -> {"tmp_path": ..., "question": n, "option": n}
+      - topics: (subject_id, número) -> título
+    """
+    records = _iter_records(csv_path)
+    if records is None:
+        return None
+
+    os.makedirs(create_db.SHARDS_DIR, exist_ok=True)
+    previous_shards = _published_shards(create_db.DB_PATH)
+    last_subject_id = _published_sequences(create_db.DB_PATH).get("subject", 0)
+
+    shards = {}
+    topics = {}
+    conns = {}
+    next_subject_id = max(max(subject_ids.values(), default=0), last_subject_id) + 1
+
+    try:
+        for record, flags in records:
+            subject_name = record["subject_name"]
+
+            if only_subject is not None and subject_name != only_subject:
+                continue
+
+            if subject_name not in subject_ids:
+                subject_ids[subject_name] = next_subject_id
+                next_subject_id += 1
+            subject_id = subject_ids[subject_name]
+
+            if subject_id not in conns:
+                tmp_path = _tmp_path(shard_path(f"subject_{subject_id}.db"))
+                _remove_if_exists(tmp_path)
+                create_shard_tables(tmp_path, subject_id)
+                conns[subject_id] = _open_build_connection(tmp_path)
+                # Ids a continuación de los del shard que se sustituye
+                if subject_id in previous_shards:
+                    _seed_sequences(
+                        conns[subject_id],
+                        _read_sequences(previous_shards[subject_id]),
+                    )
+                shards[subject_id] = {"tmp_path": tmp_path, "question": 0, "option": 0}
+
+            topic_key = (subject_id, record["topic_number"])
+            topics.setdefault(topic_key, record["topic_title"])
+
+            _insert_question(
+                conns[subject_id].cursor(),
+                _shard_topic_id(*topic_key),
+                record,
+                flags,
+            )
+            shards[subject_id]["question"] += 1
+            shards[subject_id]["option"] += len(flags)
+
+        for subject_id, conn in conns.items():
+            _build_read_model(conn)
+            shards[subject_id]["question_read"] = shards[subject_id]["question"]
+            conn.commit()
+    finally:
+        for conn in conns.values():
+            conn.close()
+
+    for shard in shards.values():
+        _verify_database(
+            shard["tmp_path"],
+            {
+                "question": shard["question"],
+                "option": shard["option"],
+                "question_read": shard["question_read"],
+            },
+        )
+
+    return shards, topics
+
+
+def _publish_shards(shards, version: str):
+    """
+    Da a cada shard temporal su nombre definitivo. Los nombres llevan la
+    versión de la importación, así que nunca se pisa un shard en uso.
+    """
+    published = {}
+
+    for subject_id, shard in shards.items():
+        name = f"subject_{subject_id}.{version}.db"
+        _fsync_file(shard["tmp_path"])
+        os.replace(shard["tmp_path"], shard_path(name))
+        published[subject_id] = name
+
+    return published
+
+
+def _write_manifest_rows(cur, subject_ids, topics, published):
+    names = {subject_id: name for name, subject_id in subject_ids.items()}
+
+    for subject_id in sorted(published):
         cur.execute(
-            """
-            INSERT INTO question (topic_id, number, text)
-            VALUES (?, ?, ?)
-            """,
-            (topic_id, question_number, question_text),
+            "INSERT OR IGNORE INTO subject (id, name) VALUES (?, ?)",
+            (subject_id, names[subject_id]),
         )
-        question_id = cur.lastrowid
-        total_questions += 1
 
-        # Insertar opciones
-        cur.executemany(
+        # Si antes estaba en la base de datos principal, se limpia
+        cur.execute(
             """
-            INSERT INTO option (question_id, text, is_correct)
-            VALUES (?, ?, ?)
+            DELETE FROM option WHERE question_id IN (
+                SELECT q.id FROM question q
+                JOIN topic t ON q.topic_id = t.id
+                WHERE t.subject_id = ?
+            )
             """,
-            [
-                (question_id, option_a, is_correct_a),
-                (question_id, option_b, is_correct_b),
-                (question_id, option_c, is_correct_c),
-                (question_id, option_d, is_correct_d),
-            ],
+            (subject_id,),
         )
-        total_options += 4
+        cur.execute(
+            "DELETE FROM question WHERE topic_id IN "
+            "(SELECT id FROM topic WHERE subject_id = ?)",
+            (subject_id,),
+        )
+        cur.execute(
+            "DELETE FROM question_read WHERE topic_id IN "
+            "(SELECT id FROM topic WHERE subject_id = ?)",
+            (subject_id,),
+        )
+        cur.execute("DELETE FROM topic WHERE subject_id = ?", (subject_id,))
 
-    conn.commit()
+        cur.execute(
+            "INSERT OR REPLACE INTO subject_shard (subject_id, shard) VALUES (?, ?)",
+            (subject_id, published[subject_id]),
+        )
+
+    cur.executemany(
+        """
+        INSERT INTO topic (id, subject_id, number, title)
+        VALUES (?, ?, ?, ?)
+        """,
+        [
+            (_shard_topic_id(subject_id, number), subject_id, number, title)
+            for (subject_id, number), title in sorted(topics.items())
+        ],
+    )
+
+
+def _import_sharded(csv_path: str):
+    """
+    Importación completa con un shard por asignatura y un manifiesto nuevo.
+    """
+    db_path = create_db.DB_PATH
+    tmp_path = _tmp_path(db_path)
+    _remove_if_exists(tmp_path)
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+
+    # Cada asignatura conserva su id (y con él los de sus temas); las nuevas
+    # reciben ids que no se han usado nunca
+    subject_ids = _read_subject_ids(db_path)
+    built = _build_shards(csv_path, subject_ids)
+    if built is None:
+        return None
+    shards, topics = built
+
+    try:
+        # Los shards se publican con el lock: así ninguna otra importación
+        # tiene un shard publicado pero aún sin registrar cuando se borran
+        # los que no están en el manifiesto nuevo
+        with _manifest_lock(db_path):
+            published = _publish_shards(shards, version)
+
+            create_tables(tmp_path)
+            conn = get_connection(tmp_path)
+            _seed_sequences(conn, _published_sequences(db_path))
+            _write_manifest_rows(conn.cursor(), subject_ids, topics, published)
+            conn.commit()
+            conn.close()
+
+            _verify_database(
+                tmp_path, {"subject": len(published), "topic": len(topics)}
+            )
+
+            _publish_manifest(tmp_path, db_path)
+            _remove_unused_shards(db_path)
+    finally:
+        _remove_if_exists(tmp_path)
+        for shard in shards.values():
+            _remove_if_exists(shard["tmp_path"])
+
+    return {
+        "subject": len(published),
+        "topic": len(topics),
+        "question": sum(shard["question"] for shard in shards.values()),
+        "option": sum(shard["option"] for shard in shards.values()),
+    }
+
+
+def _import_subject(csv_path: str, subject_name: str):
+    """
+    Reimporta una sola asignatura en un shard nuevo y actualiza su entrada
+    del manifiesto. El resto de asignaturas no se tocan.
+
+    Para una asignatura que ya existe, el shard se construye sin bloquear
+    (es lo costoso) y solo su publicación y la actualización del manifiesto
+    van con lock. Una asignatura nueva necesita reservar id, así que se
+    importa con el lock.
+    """
+    db_path = create_db.DB_PATH
+    tmp_path = _tmp_path(db_path)
+    _remove_if_exists(tmp_path)
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+
+    subject_id = _find_subject_id(db_path, subject_name)
+
+    with contextlib.ExitStack() as stack:
+        if subject_id is None:
+            stack.enter_context(_manifest_lock(db_path))
+            subject_ids = _read_subject_ids(db_path)
+        else:
+            subject_ids = {subject_name: subject_id}
+
+        built = _build_shards(csv_path, subject_ids, only_subject=subject_name)
+        if built is None:
+            return None
+        shards, topics = built
+
+        if not shards:
+            print(f"⚠️ El CSV no tiene preguntas de '{subject_name}'.")
+            return None
+
+        try:
+            if subject_id is not None:
+                stack.enter_context(_manifest_lock(db_path))
+
+            published = _publish_shards(shards, version)
+
+            # Copia del manifiesto actual sobre la que se aplica el cambio
+            _copy_database(db_path, tmp_path)
+            create_tables(tmp_path)
+            conn = get_connection(tmp_path)
+            _write_manifest_rows(conn.cursor(), subject_ids, topics, published)
+            _ensure_read_model(conn)
+            conn.commit()
+            conn.close()
+
+            _verify_database(tmp_path, {})
+            _publish_manifest(tmp_path, db_path)
+
+            # Solo los shards antiguos de esta asignatura
+            _remove_unused_shards(db_path, subject_ids=list(published))
+        finally:
+            _remove_if_exists(tmp_path)
+            for shard in shards.values():
+                _remove_if_exists(shard["tmp_path"])
+
+    return {
+        "subject": len(published),
+        "topic": len(topics),
+        "question": sum(shard["question"] for shard in shards.values()),
+        "option": sum(shard["option"] for shard in shards.values()),
+    }
+
+
+def _find_subject_id(db_path: str, subject_name: str):
+    return _read_subject_ids(db_path).get(subject_name)
+
+
+def _read_subject_ids(db_path: str):
+    if not os.path.exists(db_path):
+        return {}
+
+    conn = get_connection(db_path)
+    rows = conn.execute("SELECT id, name FROM subject").fetchall()
     conn.close()
+    return {r["name"]: r["id"] for r in rows}
 
-    print("✅ Importación terminada.")
-    print(f"   Asignaturas insertadas: {total_subjects}")
-    print(f"   Temas insertados:       {total_topics}")
-    print(f"   Preguntas insertadas:   {total_questions}")
-    print(f"   Opciones insertadas:    {total_options}")
+
+def _copy_database(source_path: str, target_path: str):
+    target = get_connection(target_path)
+    if os.path.exists(source_path):
+        source = get_connection(source_path)
+        source.backup(target)
+        source.close()
+    target.close()
+
+
+def _remove_unused_shards(db_path: str, subject_ids=None):
+    """
+    Borra los shards que ya no aparecen en el manifiesto publicado (de
+    todas las asignaturas o solo de `subject_ids`). Se llama con el lock
+    del manifiesto, que es también con el que se publican los shards.
+    """
+    if not os.path.isdir(create_db.SHARDS_DIR):
+        return
+
+    conn = get_connection(db_path)
+    in_use = {r["shard"] for r in conn.execute("SELECT shard FROM subject_shard")}
+    conn.close()
+
+    prefixes = (
+        tuple(f"subject_{subject_id}." for subject_id in subject_ids)
+        if subject_ids is not None
+        else ("subject_",)
+    )
+
+    for name in os.listdir(create_db.SHARDS_DIR):
+        if name.endswith(".db") and name.startswith(prefixes) and name not in in_use:
+            os.remove(shard_path(name))
+
+
+# ---------- Verificación y publicación ---------- #
+
+
+def _verify_database(db_path: str, totals):
+    """
+    Comprueba el fichero recién construido antes de publicarlo: integridad
+    de SQLite y nº de filas de cada tabla. Lanza RuntimeError si algo falla.
+    """
+    conn = get_connection(db_path)
+    cur = conn.cursor()
+
+    try:
+        cur.execute("PRAGMA integrity_check")
+        result = cur.fetchone()[0]
+        if result != "ok":
+            raise RuntimeError(f"integrity_check ha fallado: {result}")
+
+        if totals.get("question") == 0:
+            raise RuntimeError("El CSV no contiene ninguna pregunta válida.")
+
+        for table, expected in totals.items():
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            count = cur.fetchone()[0]
+            if count != expected:
+                raise RuntimeError(
+                    f"La tabla {table} tiene {count} filas, se esperaban {expected}."
+                )
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def _manifest_lock(db_path: str):
+    """
+    Lock exclusivo entre procesos para actualizar el manifiesto (DB_PATH).
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: no hay flock
+        fcntl = None
+
+    with open(f"{db_path}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            _lock_windows(lock_file)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                import msvcrt
+
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_windows(lock_file):
+    import msvcrt
+
+    # LK_LOCK solo reintenta unos segundos: se sigue esperando hasta tenerlo
+    while True:
+        try:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def _publish_manifest(tmp_path: str, db_path: str):
+    # Asegura que los resultados antiguos guardados en el fichero de
+    # contenido se han migrado antes de sustituirlo
+    get_results_connection().close()
+
+    _swap_into_place(tmp_path, db_path)
+
+    # Catálogo compartido de la nueva generación, listo antes de que lo
+    # pidan los procesos de la app
+    build_catalog()
+
+
+def _fsync_file(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _swap_into_place(tmp_path: str, db_path: str):
+    """
+    Sustituye `db_path` por `tmp_path` de forma atómica (mismo directorio).
+    """
+    # Como se ha escrito con synchronous = OFF, forzamos el volcado a disco
+    _fsync_file(tmp_path)
+
+    os.replace(tmp_path, db_path)
+
+    # Persistir también la entrada del directorio
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(db_path)), os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa las preguntas desde un CSV.")
+    parser.add_argument("csv_path", nargs="?", default=CSV_PATH)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Solo valida el CSV y genera un informe, sin tocar la base de datos.",
+    )
+    parser.add_argument("--report", help="Ruta donde guardar el informe JSON.")
+    parser.add_argument(
+        "--shard-by-subject",
+        action="store_true",
+        help="Guarda las preguntas de cada asignatura en su propio fichero.",
+    )
+    parser.add_argument(
+        "--subject",
+        help="Reimporta solo esta asignatura (en su shard), sin tocar las demás.",
+    )
+    args = parser.parse_args()
+
+    if args.dry_run:
+        report = validate_csv(args.csv_path, args.report)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        import_from_csv(args.csv_path, args.shard_by_subject, args.subject)
 
 
 if __name__ == "__main__":
-    import_from_csv()
+    main()
@@ -0,0 +1,276 @@
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from .create_db import get_connection, get_results_connection, questions_schema
+
+# Filas que se leen de SQLite de cada vez al cargar las respuestas
+FETCH_CHUNK_ROWS = 100_000
+
+
+def _load_answers(subject_id: int):
+    """
+    Carga las respuestas de una asignatura como arrays de NumPy (una
+    posición por respuesta): result_id, question_id, option_id (-1 si se
+    dejó en blanco), is_correct y topic_id.
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT a.result_id, a.question_id, COALESCE(a.option_id, -1),
+               a.is_correct, r.topic_id
+        FROM quiz_answer a
+        JOIN quiz_result r ON r.id = a.result_id
+        WHERE r.subject_id = ?
+        """,
+        (subject_id,),
+    )
+
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    conn.close()
+
+    data = np.concatenate(chunks) if chunks else np.empty((0, 5), dtype=np.int64)
+    return data[:, 0], data[:, 1], data[:, 2], data[:, 3].astype(np.float64), data[:, 4]
+
+
+def _load_options(subject_id: int):
+    """
+    Todas las opciones de la asignatura (aunque nadie las haya elegido):
+    arrays option_id (ordenado), question_id e is_correct.
+    """
+    conn = get_connection()
+    schema = questions_schema(conn, subject_id, mode="rw")
+    rows = conn.execute(
+        f"""
+        SELECT o.id, o.question_id, o.is_correct
+        FROM {schema}.option o
+        JOIN {schema}.question q ON q.id = o.question_id
+        JOIN topic t ON t.id = q.topic_id
+        WHERE t.subject_id = ?
+        ORDER BY o.id
+        """,
+        (subject_id,),
+    ).fetchall()
+    conn.close()
+
+    data = np.array([tuple(r) for r in rows], dtype=np.int64).reshape(-1, 3)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def _safe_divide(num, den):
+    out = np.full(np.shape(num), np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def analyze_subject(subject_id: int):
+    """
+    Calcula, para todas las preguntas de una asignatura a la vez:
+
+      - difficulty: proporción de aciertos (índice de dificultad p).
+      - discrimination: correlación punto-biserial entre acertar la pregunta
+        y la nota del intento en el resto de preguntas.
+      - por opción: cuántas veces se eligió, proporción sobre los intentos
+        que vieron la pregunta y nota media de quienes la eligieron (un
+        distractor elegido por los mejores suele indicar una clave errónea).
+
+    La matriz intentos × preguntas se trata en formato largo (una fila por
+    respuesta) y se agrega con np.bincount: todo es vectorizado y la memoria
+    crece con el nº de respuestas, no con intentos × preguntas.
+    """
+    result_ids, question_ids, option_ids, x, topic_ids = _load_answers(subject_id)
+
+    if len(result_ids) == 0:
+        return [], []
+
+    # Índices compactos de intento y de pregunta
+    attempts, a_idx = np.unique(result_ids, return_inverse=True)
+    questions, q_idx = np.unique(question_ids, return_inverse=True)
+    n_attempts = len(attempts)
+    n_questions = len(questions)
+
+    # Nota de cada intento (aciertos y nº de preguntas)
+    attempt_correct = np.bincount(a_idx, weights=x, minlength=n_attempts)
+    attempt_total = np.bincount(a_idx, minlength=n_attempts).astype(np.float64)
+    attempt_pct = attempt_correct / attempt_total
+
+    # Dificultad
+    q_seen = np.bincount(q_idx, minlength=n_questions).astype(np.float64)
+    q_correct = np.bincount(q_idx, weights=x, minlength=n_questions)
+    difficulty = _safe_divide(q_correct, q_seen)
+
+    # Punto-biserial corregida: nota del intento sin contar esta pregunta
+    rest_total = attempt_total[a_idx] - 1
+    valid = (rest_total > 0).astype(np.float64)
+    rest = np.zeros_like(x)
+    np.divide(attempt_correct[a_idx] - x, rest_total, out=rest, where=rest_total > 0)
+
+    n = np.bincount(q_idx, weights=valid, minlength=n_questions)
+    mean_x = _safe_divide(np.bincount(q_idx, weights=valid * x, minlength=n_questions), n)
+    mean_r = _safe_divide(np.bincount(q_idx, weights=valid * rest, minlength=n_questions), n)
+    mean_xr = _safe_divide(
+        np.bincount(q_idx, weights=valid * x * rest, minlength=n_questions), n
+    )
+    mean_rr = _safe_divide(
+        np.bincount(q_idx, weights=valid * rest * rest, minlength=n_questions), n
+    )
+
+    cov = mean_xr - mean_x * mean_r
+    var_x = mean_x - mean_x * mean_x
+    var_r = mean_rr - mean_r * mean_r
+    discrimination = _safe_divide(cov, np.sqrt(np.clip(var_x * var_r, 0, None)))
+
+    # Tema de cada pregunta (cualquiera de sus respuestas sirve)
+    q_topic = np.zeros(n_questions, dtype=np.int64)
+    q_topic[q_idx] = topic_ids
+
+    item_rows = [
+        (
+            int(questions[i]),
+            subject_id,
+            int(q_topic[i]),
+            int(q_seen[i]),
+            _to_float(difficulty[i]),
+            _to_float(discrimination[i]),
+        )
+        for i in range(n_questions)
+    ]
+
+    # Opciones
+    opt_ids, opt_question_ids, opt_correct = _load_options(subject_id)
+    if len(opt_ids) == 0:
+        # Asignatura sin opciones en el contenido actual (p. ej. se ha
+        # quitado del CSV): solo hay estadísticas por pregunta
+        return item_rows, []
+
+    picked = option_ids >= 0
+    opt_idx = np.minimum(np.searchsorted(opt_ids, option_ids[picked]), len(opt_ids) - 1)
+    # Solo cuentan las opciones que siguen existiendo y son de la misma
+    # pregunta que la respuesta (el contenido puede haberse reimportado)
+    known = (opt_ids[opt_idx] == option_ids[picked]) & (
+        opt_question_ids[opt_idx] == question_ids[picked]
+    )
+    opt_idx = opt_idx[known]
+    picker_pct = attempt_pct[a_idx[picked][known]]
+
+    picks = np.bincount(opt_idx, minlength=len(opt_ids)).astype(np.float64)
+    picker_score = np.bincount(opt_idx, weights=picker_pct, minlength=len(opt_ids))
+
+    # Intentos que vieron la pregunta de cada opción
+    pos = np.searchsorted(questions, opt_question_ids)
+    seen_by_option = np.zeros(len(opt_ids))
+    in_range = pos < n_questions
+    matches = in_range.copy()
+    matches[in_range] = questions[pos[in_range]] == opt_question_ids[in_range]
+    seen_by_option[matches] = q_seen[pos[matches]]
+
+    pick_rate = _safe_divide(picks, seen_by_option)
+    mean_score = _safe_divide(picker_score, picks)
+
+    option_rows = [
+        (
+            int(opt_ids[i]),
+            int(opt_question_ids[i]),
+            subject_id,
+            int(opt_correct[i]),
+            int(picks[i]),
+            _to_float(pick_rate[i]),
+            _to_float(mean_score[i]),
+        )
+        for i in range(len(opt_ids))
+        if matches[i]
+    ]
+
+    return item_rows, option_rows
+
+
+def _to_float(value):
+    return None if np.isnan(value) else float(value)
+
+
+def save_analysis(subject_id: int, item_rows, option_rows):
+    """
+    Sustituye el análisis guardado de la asignatura por el nuevo.
+    """
+    updated_at = datetime.now().isoformat(timespec="seconds")
+
+    conn = get_results_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM item_stats WHERE subject_id = ?", (subject_id,))
+    cur.execute("DELETE FROM option_stats WHERE subject_id = ?", (subject_id,))
+
+    cur.executemany(
+        """
+        INSERT OR REPLACE INTO item_stats
+            (question_id, subject_id, topic_id, attempts,
+             difficulty, discrimination, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [row + (updated_at,) for row in item_rows],
+    )
+    cur.executemany(
+        """
+        INSERT OR REPLACE INTO option_stats
+            (option_id, question_id, subject_id, is_correct,
+             picks, pick_rate, mean_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        option_rows,
+    )
+
+    conn.commit()
+    conn.close()
+
+
+def run_item_analysis(subject_ids=None):
+    """
+    Analiza las asignaturas indicadas (por defecto, todas las que tienen
+    respuestas guardadas) y guarda el resultado.
+    """
+    if subject_ids is None:
+        conn = get_results_connection()
+        subject_ids = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT DISTINCT r.subject_id
+                FROM quiz_result r
+                WHERE EXISTS (SELECT 1 FROM quiz_answer a WHERE a.result_id = r.id)
+                """
+            )
+        ]
+        conn.close()
+
+    summary = {}
+    for subject_id in subject_ids:
+        item_rows, option_rows = analyze_subject(subject_id)
+        save_analysis(subject_id, item_rows, option_rows)
+        summary[subject_id] = len(item_rows)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análisis de calidad de las preguntas.")
+    parser.add_argument(
+        "--subject",
+        type=int,
+        action="append",
+        help="Id de asignatura (se puede repetir). Por defecto, todas.",
+    )
+    args = parser.parse_args()
+
+    summary = run_item_analysis(args.subject)
+    for subject_id, n_questions in summary.items():
+        print(f"✅ Asignatura {subject_id}: {n_questions} preguntas analizadas.")
+
+
+if __name__ == "__main__":
+    main()
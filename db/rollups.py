@@ -0,0 +1,158 @@
+import argparse
+
+from .create_db import get_results_connection
+
+# Nº de buckets del histograma de notas: el bucket i cubre del i*10% al
+# (i+1)*10% (el 100% cae en el último).
+HIST_BUCKETS = 10
+
+# Porcentaje mínimo para contar un intento como aprobado
+PASS_PCT = 50
+
+
+def score_bucket(score: int, total: int) -> int:
+    return min(score * HIST_BUCKETS // total, HIST_BUCKETS - 1)
+
+
+def score_pct(score: int, total: int) -> int:
+    """
+    Porcentaje entero (0-100) con el que se guarda un resultado en el
+    histograma por tema.
+    """
+    return score * 100 // total
+
+
+def is_passed(score: int, total: int) -> bool:
+    return score * 100 >= PASS_PCT * total
+
+
+def add_result_to_rollups(cur, day: str, subject_id: int, topic_id: int, score: int, total: int):
+    """
+    Suma un resultado a los resúmenes diarios y al histograma del tema. Se
+    llama en la misma transacción que el INSERT en quiz_result.
+    """
+    if not total:
+        return
+
+    cur.execute(
+        """
+        INSERT INTO quiz_result_daily
+            (day, subject_id, topic_id, attempts, score_sum, total_sum, passed)
+        VALUES (?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT (subject_id, day, topic_id) DO UPDATE SET
+            attempts  = attempts + 1,
+            score_sum = score_sum + excluded.score_sum,
+            total_sum = total_sum + excluded.total_sum,
+            passed    = passed + excluded.passed
+        """,
+        (day, subject_id, topic_id, score, total, int(is_passed(score, total))),
+    )
+
+    cur.execute(
+        """
+        INSERT INTO quiz_result_daily_bucket
+            (day, subject_id, topic_id, bucket, attempts)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (subject_id, day, topic_id, bucket) DO UPDATE SET
+            attempts = attempts + 1
+        """,
+        (day, subject_id, topic_id, score_bucket(score, total)),
+    )
+
+    cur.execute(
+        """
+        INSERT INTO topic_score_hist (topic_id, pct, attempts)
+        VALUES (?, ?, 1)
+        ON CONFLICT (topic_id, pct) DO UPDATE SET
+            attempts = attempts + 1
+        """,
+        (topic_id, score_pct(score, total)),
+    )
+
+
+def backfill_rollups():
+    """
+    Recalcula los resúmenes diarios y los histogramas por tema a partir de
+    todas las filas de quiz_result (para los resultados guardados antes de
+    existir los resúmenes). Se hace con consultas agregadas, sin pasar por
+    Python.
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+
+    cur.execute("DELETE FROM quiz_result_daily")
+    cur.execute("DELETE FROM quiz_result_daily_bucket")
+    cur.execute("DELETE FROM topic_score_hist")
+
+    cur.execute(
+        """
+        INSERT INTO quiz_result_daily
+            (day, subject_id, topic_id, attempts, score_sum, total_sum, passed)
+        SELECT
+            date(created_at),
+            subject_id,
+            topic_id,
+            COUNT(*),
+            SUM(score),
+            SUM(total_questions),
+            SUM(score * 100 >= ? * total_questions)
+        FROM quiz_result
+        WHERE total_questions > 0
+        GROUP BY date(created_at), subject_id, topic_id
+        """,
+        (PASS_PCT,),
+    )
+
+    cur.execute(
+        """
+        INSERT INTO quiz_result_daily_bucket
+            (day, subject_id, topic_id, bucket, attempts)
+        SELECT
+            date(created_at),
+            subject_id,
+            topic_id,
+            MIN(score * ? / total_questions, ?) AS bucket,
+            COUNT(*)
+        FROM quiz_result
+        WHERE total_questions > 0
+        GROUP BY date(created_at), subject_id, topic_id, bucket
+        """,
+        (HIST_BUCKETS, HIST_BUCKETS - 1),
+    )
+
+    cur.execute(
+        """
+        INSERT INTO topic_score_hist (topic_id, pct, attempts)
+        SELECT topic_id, score * 100 / total_questions AS pct, COUNT(*)
+        FROM quiz_result
+        WHERE total_questions > 0
+        GROUP BY topic_id, pct
+        """
+    )
+
+    cur.execute("SELECT COALESCE(SUM(attempts), 0) FROM quiz_result_daily")
+    total = cur.fetchone()[0]
+
+    conn.commit()
+    conn.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resúmenes diarios de resultados.")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Recalcula los resúmenes a partir de todos los resultados guardados.",
+    )
+    args = parser.parse_args()
+
+    if args.backfill:
+        total = backfill_rollups()
+        print(f"✅ Resúmenes recalculados: {total} resultados.")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import atexit
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from db.create_db import get_results_connection
+
+# Cada cuánto se vuelcan a SQLite los cuestionarios en curso. Entre volcados
+# los cambios se acumulan en memoria y solo se guarda el último estado de
+# cada intento, así que el nº de escrituras no depende de los clics.
+CHECKPOINT_FLUSH_SECONDS = 2.0
+
+# Un cuestionario sin tocar durante más tiempo se da por abandonado: ya no
+# se ofrece al volver a entrar y se borra en el siguiente volcado
+CHECKPOINT_MAX_AGE = timedelta(hours=12)
+
+_pending_lock = threading.Lock()
+# (user_email, attempt_id) -> fila a guardar, o None para borrarla
+_pending = {}
+# Lote que se está escribiendo: sigue visible para las lecturas hasta el
+# commit
+_writing = {}
+# Solo un volcado a la vez (hilo de volcado y atexit)
+_flush_lock = threading.Lock()
+_writer_thread = None
+
+
+def _oldest_valid_updated_at() -> str:
+    return (datetime.now() - CHECKPOINT_MAX_AGE).isoformat(timespec="seconds")
+
+
+def new_attempt_id() -> str:
+    return uuid.uuid4().hex
+
+
+# ---------- ESCRITURA DIFERIDA ---------- #
+
+def save_checkpoint(
+    user_email: str,
+    attempt_id: str,
+    subject_id: int,
+    topic_id: int,
+    quiz_seed: int,
+    answers: dict,
+):
+    """
+    Apunta el estado actual de un intento. No escribe en la base de datos:
+    el hilo de volcado lo guarda en el siguiente lote.
+    """
+    row = {
+        "user_email": user_email,
+        "attempt_id": attempt_id,
+        "subject_id": subject_id,
+        "topic_id": topic_id,
+        "quiz_seed": quiz_seed,
+        "answers": json.dumps(
+            {str(q_id): opt_id for q_id, opt_id in answers.items() if opt_id is not None}
+        ),
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    _enqueue((user_email, attempt_id), row)
+
+
+def discard_checkpoint(user_email: str, attempt_id: str):
+    """
+    El intento ha terminado (o se ha abandonado): se borra en el siguiente
+    lote.
+    """
+    _enqueue((user_email, attempt_id), None)
+
+
+def _enqueue(key, row):
+    global _writer_thread
+
+    with _pending_lock:
+        _pending[key] = row
+
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+            _writer_thread.start()
+
+
+def _writer_loop():
+    while True:
+        time.sleep(CHECKPOINT_FLUSH_SECONDS)
+        try:
+            flush_checkpoints()
+        except Exception as exc:
+            print(f"⚠️ Error guardando cuestionarios en curso: {exc}")
+
+
+def flush_checkpoints():
+    """
+    Vuelca todos los cambios pendientes en una sola transacción y borra los
+    cuestionarios abandonados (más antiguos que CHECKPOINT_MAX_AGE).
+    """
+    with _flush_lock:
+        return _flush_batch()
+
+
+def _flush_batch():
+    global _pending, _writing
+
+    with _pending_lock:
+        batch = _pending
+        _pending = {}
+        _writing = batch
+
+    if not batch:
+        return 0
+
+    upserts = [row for row in batch.values() if row is not None]
+    deletes = [key for key, row in batch.items() if row is None]
+
+    conn = None
+    try:
+        conn = get_results_connection()
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO quiz_checkpoint
+                (user_email, attempt_id, subject_id, topic_id,
+                 quiz_seed, answers, updated_at)
+            VALUES
+                (:user_email, :attempt_id, :subject_id, :topic_id,
+                 :quiz_seed, :answers, :updated_at)
+            ON CONFLICT (user_email, attempt_id) DO UPDATE SET
+                subject_id = excluded.subject_id,
+                topic_id   = excluded.topic_id,
+                quiz_seed  = excluded.quiz_seed,
+                answers    = excluded.answers,
+                updated_at = excluded.updated_at
+            """,
+            upserts,
+        )
+        cur.executemany(
+            "DELETE FROM quiz_checkpoint WHERE user_email = ? AND attempt_id = ?",
+            deletes,
+        )
+        cur.execute(
+            "DELETE FROM quiz_checkpoint WHERE updated_at < ?",
+            (_oldest_valid_updated_at(),),
+        )
+        conn.commit()
+    except Exception:
+        # Que no se pierda el lote: se reintenta en el siguiente volcado
+        with _pending_lock:
+            for key, row in batch.items():
+                _pending.setdefault(key, row)
+        raise
+    finally:
+        with _pending_lock:
+            _writing = {}
+        if conn is not None:
+            conn.close()
+
+    return len(batch)
+
+
+# Al parar el proceso de forma ordenada se guarda lo pendiente
+atexit.register(flush_checkpoints)
+
+
+# ---------- LECTURA ---------- #
+
+def get_latest_checkpoint(user_email: str):
+    """
+    Devuelve el último intento sin terminar del usuario (de menos de
+    CHECKPOINT_MAX_AGE), o None. Tiene en cuenta los cambios que aún no se
+    han volcado o se están volcando.
+    """
+    oldest = _oldest_valid_updated_at()
+
+    with _pending_lock:
+        # Lo pendiente es más reciente que lo que se está escribiendo
+        unsaved = {**_writing, **_pending}
+        pending = [(key, row) for key, row in unsaved.items() if key[0] == user_email]
+
+    discarded = {key[1] for key, row in pending if row is None}
+    candidates = [
+        row for key, row in pending if row is not None and row["updated_at"] >= oldest
+    ]
+
+    conn = get_results_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT user_email, attempt_id, subject_id, topic_id,
+               quiz_seed, answers, updated_at
+        FROM quiz_checkpoint
+        WHERE user_email = ?
+          AND updated_at >= ?
+        ORDER BY updated_at DESC
+        """,
+        (user_email, oldest),
+    )
+    pending_ids = {key[1] for key, row in pending if row is not None}
+    candidates += [
+        dict(r)
+        for r in cur.fetchall()
+        if r["attempt_id"] not in discarded and r["attempt_id"] not in pending_ids
+    ]
+    conn.close()
+
+    if not candidates:
+        return None
+
+    latest = max(candidates, key=lambda r: r["updated_at"])
+
+    return {
+        **latest,
+        "answers": {int(q_id): opt_id for q_id, opt_id in json.loads(latest["answers"]).items()},
+    }
@@ -1,105 +1,118 @@
+import json
 import sqlite3
 import random
-from db.create_db import get_connection
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from db.create_db import (
+    content_generation,
+    get_read_connection,
+    get_results_connection,
+    questions_schema,
+)
+from db.catalog import get_catalog
+from db.rollups import add_result_to_rollups, score_pct
 
 
 # ---------- ASIGNATURAS ---------- #
+#
+# Asignaturas y temas se leen del catálogo compartido (db/catalog.py), que
+# todos los procesos del servidor mapean en memoria, en vez de consultar
+# SQLite en cada petición.
 
 def get_subjects():
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    return get_catalog().subjects()
 
-    cur.execute(
-        """
-        SELECT id, name
-        FROM subject
-        ORDER BY name
-        """
-    )
-    rows = cur.fetchall()
-    conn.close()
 
-    return [{"id": r["id"], "name": r["name"]} for r in rows]
+def get_subject_name(subject_id: int):
+    return get_catalog().subject_name(subject_id)
 
 
-def get_subject_name(subject_id: int):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+# ---------- TEMAS ---------- #
 
-    cur.execute(
-        "SELECT name FROM subject WHERE id = ?",
-        (subject_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+def get_topics_by_subject(subject_id: int):
+    return get_catalog().topics_by_subject(subject_id)
 
-    return row["name"] if row else None
 
+def get_topic_name(topic_id: int):
+    topic = get_catalog().topic(topic_id)
+    return topic["name"] if topic else None
 
-# ---------- TEMAS ---------- #
 
-def get_topics_by_subject(subject_id: int):
-    conn = get_connection()
+# ---------- PREGUNTAS Y OPCIONES ---------- #
+
+def get_questions_by_topic(topic_id: int):
+    """
+    Devuelve una lista de preguntas de un tema con sus opciones en el orden
+    canónico de la base de datos (sin barajar y sin etiquetas).
+
+    Para mostrarlas a un alumno se usa `shuffle_options` con la semilla
+    del intento.
+    """
+
+    conn = get_read_connection()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
 
+    topic = get_catalog().topic(topic_id)
+    if topic is None:
+        conn.close()
+        return []
+
+    # Las preguntas pueden estar en el shard de la asignatura
+    schema = questions_schema(conn, topic["subject_id"])
+
+    try:
+        questions = _questions_from_read_model(cur, schema, topic_id)
+    except sqlite3.OperationalError:
+        # Base de datos importada antes de existir question_read
+        questions = None
+
+    if not questions:
+        # Sin tabla question_read, o con la tabla aún sin rellenar para
+        # este tema: se lee de las tablas normalizadas
+        questions = _questions_from_tables(cur, schema, topic_id)
+
+    conn.close()
+    return questions
+
+
+def _questions_from_read_model(cur, schema: str, topic_id: int):
+    # Un único recorrido por rango de la clave (topic_id, number, question_id)
     cur.execute(
-        """
-        SELECT id, number, title
-        FROM topic
-        WHERE subject_id = ?
-        ORDER BY number
+        f"""
+        SELECT question_id, number, text, options
+        FROM {schema}.question_read
+        WHERE topic_id = ?
+        ORDER BY number, question_id
         """,
-        (subject_id,),
+        (topic_id,),
     )
-    rows = cur.fetchall()
-    conn.close()
 
     return [
         {
-            "id": r["id"],
+            "id": r["question_id"],
+            "text": r["text"],
             "number": r["number"],
-            "name": r["title"],
+            "options": [
+                {"id": o_id, "text": o_text, "is_correct": bool(o_correct)}
+                for o_id, o_text, o_correct in json.loads(r["options"])
+            ],
         }
-        for r in rows
+        for r in cur.fetchall()
     ]
 
 
-def get_topic_name(topic_id: int):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute(
-        "SELECT title FROM topic WHERE id = ?",
-        (topic_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-
-    return row["title"] if row else None
-
-
-# ---------- PREGUNTAS Y OPCIONES ---------- #
-
-def get_questions_by_topic(topic_id: int):
-    """
-    Devuelve una lista de preguntas de un tema con sus opciones barajadas.
-    """
-
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
+def _questions_from_tables(cur, schema: str, topic_id: int):
     # Preguntas del tema
     cur.execute(
-        """
+        f"""
         SELECT id, text, number
-        FROM question
+        FROM {schema}.question
         WHERE topic_id = ?
-        ORDER BY number
+        ORDER BY number, id
         """,
         (topic_id,),
     )
@@ -108,112 +121,483 @@ def get_questions_by_topic(topic_id: int):
     questions = []
 
     for q_row in question_rows:
-        q_id = q_row["id"]
-
-        # =====================================================
-        # 🔥 CAMBIO: ahora NO ordenamos por ID en la consulta
-        # =====================================================
         cur.execute(
-            """
+            f"""
             SELECT id, text, is_correct
-            FROM option
+            FROM {schema}.option
             WHERE question_id = ?
+            ORDER BY id
             """,
-            (q_id,),
+            (q_row["id"],),
         )
         option_rows = cur.fetchall()
 
-        # =====================================================
-        # 🔥 CAMBIO: barajar aleatoriamente las opciones
-        # =====================================================
-        option_rows = list(option_rows)   # convertir Row a lista normal
-        random.shuffle(option_rows)
-
-        # Volver a asignar etiquetas A, B, C, D según el nuevo orden
-        options = []
-        for idx, o in enumerate(option_rows):
-            label = chr(ord("A") + idx)
-            options.append(
-                {
-                    "id": o["id"],
-                    "text": o["text"],
-                    "label": label,
-                    "is_correct": bool(o["is_correct"]),
-                }
-            )
-
         questions.append(
             {
                 "id": q_row["id"],
                 "text": q_row["text"],
                 "number": q_row["number"],
-                "options": options,
+                "options": [
+                    {
+                        "id": o["id"],
+                        "text": o["text"],
+                        "is_correct": bool(o["is_correct"]),
+                    }
+                    for o in option_rows
+                ],
             }
         )
 
-    conn.close()
     return questions
 
 
+# ---------- CACHÉ Y PRECARGA DE PREGUNTAS ---------- #
+#
+# Las preguntas de un tema se guardan en una caché pequeña (LRU con
+# caducidad) y se pueden precargar en segundo plano, p. ej. el tema
+# siguiente mientras el alumno mira sus resultados.
+
+QUESTION_CACHE_MAX_TOPICS = 32
+QUESTION_CACHE_TTL_SECONDS = 300
+# Cada cuántas consultas a la caché se escriben sus contadores en el log
+# del servidor (no se muestran a los alumnos)
+QUESTION_CACHE_LOG_EVERY = 500
+
+_question_cache_lock = threading.Lock()
+# topic_id -> {"questions", "expires_at", "generation", "prefetched"}
+_question_cache = OrderedDict()
+# topic_id -> Future de una precarga en marcha
+_prefetch_futures = {}
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "prefetched": 0,
+    "prefetch_hits": 0,
+    "prefetch_errors": 0,
+}
+
+
+def _is_fresh(entry, generation) -> bool:
+    return (
+        entry is not None
+        and entry["generation"] == generation
+        and entry["expires_at"] > time.monotonic()
+    )
+
+
+def _store_questions(topic_id: int, generation, questions, prefetched: bool):
+    with _question_cache_lock:
+        _question_cache[topic_id] = {
+            "questions": questions,
+            "expires_at": time.monotonic() + QUESTION_CACHE_TTL_SECONDS,
+            "generation": generation,
+            "prefetched": prefetched,
+        }
+        _question_cache.move_to_end(topic_id)
+
+        while len(_question_cache) > QUESTION_CACHE_MAX_TOPICS:
+            _question_cache.popitem(last=False)
+
+
+def _load_for_prefetch(topic_id: int):
+    try:
+        generation = content_generation()
+        _store_questions(topic_id, generation, get_questions_by_topic(topic_id), True)
+    finally:
+        with _question_cache_lock:
+            _prefetch_futures.pop(topic_id, None)
+
+
+def prefetch_questions(topic_id: int):
+    """
+    Lanza en segundo plano la carga de las preguntas de un tema, si no están
+    ya en la caché. No bloquea.
+    """
+    if topic_id is None:
+        return
+
+    generation = content_generation()
+
+    with _question_cache_lock:
+        if _is_fresh(_question_cache.get(topic_id), generation):
+            return
+        if topic_id in _prefetch_futures:
+            return
+
+        _cache_stats["prefetched"] += 1
+        _prefetch_futures[topic_id] = _prefetch_executor.submit(
+            _load_for_prefetch, topic_id
+        )
+
+
+def get_questions_cached(topic_id: int):
+    """
+    Como `get_questions_by_topic`, pero pasando por la caché. Si hay una
+    precarga en marcha para el tema, espera a que termine en vez de repetir
+    la consulta; si la precarga falla, se carga normalmente.
+
+    La lista devuelta es compartida: no hay que modificarla (usar
+    `shuffle_options`, que hace copias).
+    """
+    generation = content_generation()
+
+    with _question_cache_lock:
+        entry = _question_cache.get(topic_id)
+        future = _prefetch_futures.get(topic_id)
+
+    if not _is_fresh(entry, generation) and future is not None:
+        try:
+            future.result()
+        except Exception as exc:
+            print(f"⚠️ Error precargando el tema {topic_id}: {exc}")
+            with _question_cache_lock:
+                _cache_stats["prefetch_errors"] += 1
+        with _question_cache_lock:
+            entry = _question_cache.get(topic_id)
+
+    with _question_cache_lock:
+        hit = _is_fresh(entry, generation)
+        if hit:
+            _cache_stats["hits"] += 1
+            if entry["prefetched"]:
+                _cache_stats["prefetch_hits"] += 1
+                entry["prefetched"] = False
+            _question_cache.move_to_end(topic_id)
+        else:
+            _cache_stats["misses"] += 1
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+
+    if lookups % QUESTION_CACHE_LOG_EVERY == 0:
+        _log_cache_stats()
+
+    if hit:
+        return entry["questions"]
+
+    questions = get_questions_by_topic(topic_id)
+    _store_questions(topic_id, generation, questions, False)
+    return questions
+
+
+def _log_cache_stats():
+    stats = get_prefetch_stats()
+    print(
+        f"📊 Caché de preguntas: {stats['hit_rate']:.0%} de aciertos, "
+        f"precargas usadas: {stats['prefetch_hit_rate']:.0%} "
+        f"({stats['prefetched']} precargas, {stats['prefetch_errors']} con error)"
+    )
+
+
+def get_prefetch_stats():
+    """
+    Contadores de la caché de preguntas. `prefetch_hit_rate` es la fracción
+    de precargas que luego se han usado. Son datos de operación: se escriben
+    periódicamente en el log, no en la interfaz.
+    """
+    with _question_cache_lock:
+        stats = dict(_cache_stats)
+
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["prefetch_hit_rate"] = (
+        stats["prefetch_hits"] / stats["prefetched"] if stats["prefetched"] else 0.0
+    )
+    return stats
+
+
+# ---------- BARAJADO REPRODUCIBLE ---------- #
+
+def new_quiz_seed() -> int:
+    """
+    Genera la semilla de un intento nuevo. Es lo único que hay que guardar
+    en sesión para poder reconstruir el orden de las opciones.
+    """
+    return random.getrandbits(32)
+
+
+def option_permutation(seed: int, question_id: int, n_options: int):
+    """
+    Permutación determinista de `n_options` elementos para una pregunta.
+
+    Depende solo de (semilla, id de pregunta), así que el mismo intento se
+    ve siempre igual en cualquier proceso (útil para reproducir incidencias).
+    """
+    rng = random.Random(f"{seed}:{question_id}")
+    order = list(range(n_options))
+    rng.shuffle(order)
+    return order
+
+
+def shuffle_options(questions, seed: int):
+    """
+    Devuelve una copia de `questions` con las opciones permutadas según la
+    semilla y con las etiquetas A, B, C, D asignadas en el orden mostrado.
+    """
+    shuffled = []
+
+    for q in questions:
+        options = q["options"]
+        order = option_permutation(seed, q["id"], len(options))
+
+        shuffled.append(
+            {
+                **q,
+                "options": [
+                    {**options[i], "label": chr(ord("A") + pos)}
+                    for pos, i in enumerate(order)
+                ],
+            }
+        )
+
+    return shuffled
+
+
 # ---------- RESULTADOS / HISTORIAL ---------- #
 
-def _ensure_quiz_result_table(cur):
+def save_quiz_result(
+    subject_id: int,
+    topic_id: int,
+    score: int,
+    total_questions: int,
+    answers=None,
+    user_email: str = None,
+):
+    """
+    Guarda un intento. `answers` es opcional: lista de tuplas
+    (question_id, option_id o None, is_correct) con lo que respondió el
+    alumno en cada pregunta, para el análisis de preguntas.
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS quiz_result (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            subject_id INTEGER,
-            topic_id INTEGER,
-            score INTEGER,
-            total_questions INTEGER,
-            created_at TEXT DEFAULT (datetime('now','localtime'))
+        INSERT INTO quiz_result (subject_id, topic_id, score, total_questions, user_email)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (subject_id, topic_id, score, total_questions, user_email),
+    )
+    result_id = cur.lastrowid
+
+    if answers:
+        cur.executemany(
+            """
+            INSERT INTO quiz_answer (result_id, question_id, option_id, is_correct)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                (result_id, question_id, option_id, int(is_correct))
+                for question_id, option_id, is_correct in answers
+            ],
         )
-        """
+
+    cur.execute(
+        "SELECT date(created_at) FROM quiz_result WHERE id = ?",
+        (result_id,),
     )
+    day = cur.fetchone()[0]
 
+    # Resúmenes diarios, en la misma transacción
+    add_result_to_rollups(cur, day, subject_id, topic_id, score, total_questions)
+
+    conn.commit()
+    conn.close()
 
-def save_quiz_result(subject_id: int, topic_id: int, score: int, total_questions: int):
-    conn = get_connection()
-    cur = conn.cursor()
 
-    _ensure_quiz_result_table(cur)
+def get_quiz_history(subject_id: int):
+    conn = get_results_connection()
+    cur = conn.cursor()
 
     cur.execute(
         """
-        INSERT INTO quiz_result (subject_id, topic_id, score, total_questions)
-        VALUES (?, ?, ?, ?)
+        SELECT score, total_questions, created_at, topic_id
+        FROM quiz_result
+        WHERE subject_id = ?
+        ORDER BY datetime(created_at) DESC
+        LIMIT 50
         """,
-        (subject_id, topic_id, score, total_questions),
+        (subject_id,),
     )
 
-    conn.commit()
+    rows = [dict(r) for r in cur.fetchall()]
     conn.close()
 
+    # Los títulos de los temas están en la base de datos de contenido
+    topic_names = {}
+    for r in rows:
+        topic_id = r.pop("topic_id")
+        if topic_id not in topic_names:
+            topic_names[topic_id] = get_topic_name(topic_id)
+        r["topic_name"] = topic_names[topic_id]
 
-def get_quiz_history(subject_id: int):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    return rows
+
+
+def get_daily_stats(subject_id: int, topic_id: int = None, days: int = 30):
+    """
+    Evolución diaria de una asignatura (o de un tema) en los últimos `days`
+    días, leída solo de los resúmenes diarios.
+
+    Devuelve una lista de dicts ordenada por día con: intentos, nota media
+    (%) y porcentaje de aprobados.
+    """
+    conn = get_results_connection()
     cur = conn.cursor()
 
-    _ensure_quiz_result_table(cur)
+    query = """
+        SELECT
+            day,
+            SUM(attempts)  AS attempts,
+            SUM(score_sum) AS score_sum,
+            SUM(total_sum) AS total_sum,
+            SUM(passed)    AS passed
+        FROM quiz_result_daily
+        WHERE subject_id = ?
+          AND day >= date('now', 'localtime', ?)
+    """
+    params = [subject_id, f"-{days} days"]
+
+    if topic_id is not None:
+        query += " AND topic_id = ?"
+        params.append(topic_id)
+
+    query += " GROUP BY day ORDER BY day"
+
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    conn.close()
+
+    return [
+        {
+            "day": r["day"],
+            "attempts": r["attempts"],
+            "avg_pct": 100 * r["score_sum"] / r["total_sum"] if r["total_sum"] else 0,
+            "pass_pct": 100 * r["passed"] / r["attempts"] if r["attempts"] else 0,
+        }
+        for r in rows
+    ]
+
+
+# Intentos de otros necesarios para mostrar el percentil
+PERCENTILE_MIN_ATTEMPTS = 5
+
+
+def get_percentile(topic_id: int, score: int, total: int):
+    """
+    Percentil de una nota dentro de los demás intentos de un tema: qué
+    porcentaje de intentos ha sacado menos (contando la mitad de los que
+    han sacado lo mismo).
+
+    La nota ya está guardada cuando se muestra (finish_quiz), así que se
+    descuenta a sí misma. Se calcula con el histograma del tema (101
+    buckets como máximo), sin recorrer quiz_result. Devuelve None si hay
+    menos de PERCENTILE_MIN_ATTEMPTS intentos con los que comparar.
+    """
+    if not total:
+        return None
+
+    pct = score_pct(score, total)
+
+    conn = get_results_connection()
+    cur = conn.cursor()
 
     cur.execute(
         """
         SELECT
-            qr.score,
-            qr.total_questions,
-            qr.created_at,
-            t.title AS topic_name
-        FROM quiz_result qr
-        LEFT JOIN topic t ON qr.topic_id = t.id
-        WHERE qr.subject_id = ?
-        ORDER BY datetime(qr.created_at) DESC
-        LIMIT 50
+            COALESCE(SUM(attempts), 0) AS total_attempts,
+            COALESCE(SUM(CASE WHEN pct < ? THEN attempts END), 0) AS below,
+            COALESCE(SUM(CASE WHEN pct = ? THEN attempts END), 0) AS equal
+        FROM topic_score_hist
+        WHERE topic_id = ?
         """,
-        (subject_id,),
+        (pct, pct, topic_id),
     )
+    row = cur.fetchone()
+    conn.close()
+
+    # Sin el propio intento (un empate en su mismo porcentaje)
+    equal = max(row["equal"] - 1, 0)
+    others = row["total_attempts"] - (row["equal"] - equal)
+
+    if others < PERCENTILE_MIN_ATTEMPTS:
+        return None
+
+    return 100 * (row["below"] + equal / 2) / others
+
+
+# ---------- ANÁLISIS DE PREGUNTAS ---------- #
 
+# Umbrales para marcar una pregunta como "a revisar"
+ITEM_MIN_ATTEMPTS = 20
+ITEM_TOO_EASY = 0.95
+ITEM_TOO_HARD = 0.25
+ITEM_MIN_DISCRIMINATION = 0.1
+# Un distractor solo cuenta como "posible clave errónea" si lo ha elegido
+# un grupo apreciable de alumnos (no un despiste de un buen alumno)
+ITEM_MIN_DISTRACTOR_PICKS = 5
+ITEM_MIN_DISTRACTOR_RATE = 0.1
+
+
+def get_flagged_questions(subject_id: int):
+    """
+    Preguntas de la asignatura que el último análisis (db/item_analysis.py)
+    marca como sospechosas, con el motivo:
+
+      - demasiado fácil / difícil (índice de dificultad),
+      - discrimina poco (punto-biserial baja o negativa),
+      - posible clave errónea (un distractor elegido por bastantes alumnos,
+        con mejor nota media que quienes eligen la respuesta correcta).
+    """
+    conn = get_results_connection()
+    cur = conn.cursor()
+
+    cur.execute(
+        """
+        SELECT
+            i.question_id,
+            i.topic_id,
+            i.attempts,
+            i.difficulty,
+            i.discrimination,
+            EXISTS (
+                SELECT 1
+                FROM option_stats d
+                JOIN option_stats k
+                  ON k.question_id = d.question_id AND k.is_correct = 1
+                WHERE d.question_id = i.question_id
+                  AND d.is_correct = 0
+                  AND d.picks >= ?
+                  AND d.pick_rate >= ?
+                  AND d.mean_score > COALESCE(k.mean_score, 0)
+            ) AS suspicious_key
+        FROM item_stats i
+        WHERE i.subject_id = ?
+          AND i.attempts >= ?
+        ORDER BY i.topic_id, i.question_id
+        """,
+        (
+            ITEM_MIN_DISTRACTOR_PICKS,
+            ITEM_MIN_DISTRACTOR_RATE,
+            subject_id,
+            ITEM_MIN_ATTEMPTS,
+        ),
+    )
     rows = cur.fetchall()
     conn.close()
 
-    return [dict(r) for r in rows]
+    flagged = []
+    for r in rows:
+        reasons = []
+        if r["difficulty"] is not None and r["difficulty"] >= ITEM_TOO_EASY:
+            reasons.append("demasiado fácil")
+        if r["difficulty"] is not None and r["difficulty"] <= ITEM_TOO_HARD:
+            reasons.append("demasiado difícil")
+        if r["discrimination"] is not None and r["discrimination"] < ITEM_MIN_DISCRIMINATION:
+            reasons.append("discrimina poco")
+        if r["suspicious_key"]:
+            reasons.append("posible clave errónea")
+
+        if reasons:
+            flagged.append({**dict(r), "reasons": reasons})
+
+    return flagged